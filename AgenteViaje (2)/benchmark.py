@@ -0,0 +1,198 @@
+"""Benchmarks for the hospital placement optimizer.
+
+Runs get_cost, tsp_optimize and random_restart over a matrix of grid
+sizes, house densities and hospital counts, and writes the measurements
+as JSON so runs from different versions can be compared.
+
+    python benchmark.py --sizes 50x50 200x200 --densities 0.01 0.05 \\
+        --hospitals 3 10 --output bench.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from hospitals import Space
+
+
+def build_space(height, width, density, num_hospitals, seed):
+    """Creates a space with `density` of its cells holding houses."""
+    rng = random.Random(seed)
+    space = Space(height, width, num_hospitals)
+    num_houses = max(1, int(height * width * density))
+    for cell in rng.sample(range(height * width), num_houses):
+        space.add_house(*divmod(cell, width))
+    return space
+
+
+def measure(function, repeat=3):
+    """Runs `function` and returns its result, wall times and peak memory.
+
+    The wall time is taken over `repeat` untraced runs (median and best);
+    tracemalloc slows Python-heavy code far more than NumPy-heavy code, so
+    peak memory comes from one extra traced run. `function` must do the
+    same work on every call.
+    """
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, float(np.median(times)), min(times), peak
+
+
+def bench_get_cost(space, rng, calls, repeat=3):
+    """Cost evaluations per second over random hospital sets."""
+    candidates = []
+    for i in range(calls):
+        space.hospitals = set()
+        for j in range(space.num_hospitals):
+            space.place_hospital(space.random_free_cell(rng))
+        candidates.append(set(space.hospitals))
+    # Build the cost engine outside the timed region
+    space.engine
+
+    def run():
+        return [space.get_cost(hospitals) for hospitals in candidates]
+
+    costs, elapsed, best, peak = measure(run, repeat)
+    return {
+        "calls": calls,
+        "seconds": elapsed,
+        "seconds_best": best,
+        "evaluations_per_second": calls / elapsed if elapsed else None,
+        "mean_cost": float(np.mean(costs)),
+        "peak_memory_bytes": peak,
+    }
+
+
+def bench_tsp_optimize(space, seed, maximum, strategy, repeat=3):
+    """Time to converge and final cost of one seeded run."""
+    result, elapsed, best, peak = measure(lambda: space.tsp_optimize(
+        maximum=maximum, rng=random.Random(seed), strategy=strategy
+    ), repeat)
+    return {
+        "strategy": strategy,
+        "seconds": elapsed,
+        "seconds_best": best,
+        "iterations": result.iterations,
+        "evaluations": result.evaluations,
+        "evaluations_per_second": (
+            result.evaluations / elapsed if elapsed else None
+        ),
+        "final_cost": result.cost,
+        "peak_memory_bytes": peak,
+    }
+
+
+def bench_random_restart(space, seed, restarts, strategy, repeat=3):
+    """Wall time and best cost of a serial restart run."""
+    def run():
+        random.seed(seed)
+        return space.random_restart(restarts, strategy=strategy)
+
+    hospitals, elapsed, best, peak = measure(run, repeat)
+    return {
+        "strategy": strategy,
+        "restarts": restarts,
+        "seconds": elapsed,
+        "seconds_best": best,
+        "seconds_per_restart": elapsed / restarts,
+        "best_cost": space.get_cost(hospitals),
+        "peak_memory_bytes": peak,
+    }
+
+
+def run_benchmarks(sizes, densities, hospital_counts, seed=0, cost_calls=200,
+                   maximum=None, restarts=5, strategy="steepest", repeat=3,
+                   log=False):
+    """Runs every benchmark over the full parameter matrix."""
+    cases = []
+    for height, width in sizes:
+        for density in densities:
+            for num_hospitals in hospital_counts:
+                space = build_space(height, width, density, num_hospitals, seed)
+                if log:
+                    print(f"{height}x{width} density={density} "
+                          f"hospitals={num_hospitals}", file=sys.stderr)
+                cases.append({
+                    "height": height,
+                    "width": width,
+                    "density": density,
+                    "houses": len(space.houses),
+                    "hospitals": num_hospitals,
+                    "get_cost": bench_get_cost(
+                        space, random.Random(seed), cost_calls, repeat
+                    ),
+                    "tsp_optimize": bench_tsp_optimize(
+                        space, seed, maximum, strategy, repeat
+                    ),
+                    "random_restart": bench_random_restart(
+                        space, seed, restarts, strategy, repeat
+                    ),
+                })
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "seed": seed,
+        "repeat": repeat,
+        "cases": cases,
+    }
+
+
+def parse_size(text):
+    height, width = text.lower().split("x")
+    return int(height), int(width)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=parse_size,
+                        default=[(50, 50), (200, 200), (500, 500)],
+                        help="grid sizes as HEIGHTxWIDTH")
+    parser.add_argument("--densities", nargs="+", type=float,
+                        default=[0.01, 0.05],
+                        help="fraction of cells holding a house")
+    parser.add_argument("--hospitals", nargs="+", type=int,
+                        default=[3, 10, 50])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cost-calls", type=int, default=200)
+    parser.add_argument("--maximum", type=int, default=None,
+                        help="step budget for tsp_optimize")
+    parser.add_argument("--restarts", type=int, default=5)
+    parser.add_argument("--strategy", default="steepest")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per benchmark (median reported)")
+    parser.add_argument("--output", help="JSON file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(
+        args.sizes, args.densities, args.hospitals, seed=args.seed,
+        cost_calls=args.cost_calls, maximum=args.maximum,
+        restarts=args.restarts, strategy=args.strategy,
+        repeat=args.repeat, log=True
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
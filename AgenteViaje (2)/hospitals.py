@@ -1,119 +1,973 @@
+import math
+import os
+import queue
 import random
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from python_tsp.heuristics import solve_tsp_simulated_annealing as solve_sa
 
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+
+class CostEngine():
+
+    # Upper bound on the (candidates x houses x hospitals) block that
+    # batch_cost materializes at once.
+    BLOCK_SIZE = 1 << 22
+
+    # Nearest-hospital queries go through a HospitalIndex once there are
+    # more than INDEX_THRESHOLD hospitals and the houses x hospitals distance
+    # matrix would exceed INDEX_SIZE entries; below that the dense matrix is
+    # faster.
+    INDEX_THRESHOLD = 32
+    INDEX_SIZE = 1 << 22
+
+    # Stand-in for "no second hospital" when only one hospital is placed.
+    FAR = np.iinfo(np.int64).max // 4
+
+    def __init__(self, houses):
+        """Store house coordinates as contiguous row/column arrays."""
+        coords = np.array(sorted(houses), dtype=np.int64).reshape(-1, 2)
+        self.rows = np.ascontiguousarray(coords[:, 0])
+        self.cols = np.ascontiguousarray(coords[:, 1])
+        self._groups = {}
+
+    def distances(self, hospitals):
+        """Returns the (houses x hospitals) Manhattan distance matrix."""
+        coords = np.array(list(hospitals), dtype=np.int64).reshape(-1, 2)
+        return (
+            np.abs(self.rows[:, None] - coords[None, :, 0])
+            + np.abs(self.cols[:, None] - coords[None, :, 1])
+        )
+
+    def use_index(self, count):
+        """Whether queries over `count` hospitals should use a HospitalIndex."""
+        return (
+            count > self.INDEX_THRESHOLD
+            and len(self.rows) * count > self.INDEX_SIZE
+        )
+
+    def cost(self, hospitals, index=None):
+        """Sum of distances from every house to its nearest hospital.
+
+        When a HospitalIndex over `hospitals` is given it answers the query.
+        """
+        if len(self.rows) == 0:
+            return 0
+        if index is None and self.use_index(len(hospitals)):
+            index = HospitalIndex(self, hospitals)
+        if index is not None:
+            return int(index.nearest(ties=False)[1].sum())
+        return int(self.distances(hospitals).min(axis=1).sum())
+
+    def assign(self, hospitals, index=None):
+        """Nearest-hospital bookkeeping for every house.
+
+        Returns the nearest hospital (as a position in `hospitals`), the
+        distance to it, the distance to the second-nearest hospital, and for
+        every hospital the houses for which it is (tied) nearest. When a
+        HospitalIndex over `hospitals` is given it answers the queries.
+        """
+        if index is not None:
+            return index.nearest()
+
+        dist = self.distances(hospitals)
+        houses, count = dist.shape
+        nearest = dist.argmin(axis=1)
+        first = dist[np.arange(houses), nearest]
+        if count > 1:
+            second = np.partition(dist, 1, axis=1)[:, 1]
+        else:
+            second = np.full(houses, self.FAR, dtype=np.int64)
+        tied = dist == first[:, None]
+        affected = [np.flatnonzero(tied[:, j]) for j in range(count)]
+        return nearest, first, second, affected
+
+    def groups(self, bucket):
+        """Houses grouped by the `bucket`-sized grid square they fall in."""
+        if bucket not in self._groups:
+            keys_r = self.rows // bucket
+            keys_c = self.cols // bucket
+            order = np.lexsort((keys_c, keys_r))
+            splits = np.flatnonzero(
+                np.diff(keys_r[order]) | np.diff(keys_c[order])
+            ) + 1
+            self._groups[bucket] = [
+                ((int(keys_r[group[0]]), int(keys_c[group[0]])), group)
+                for group in np.split(order, splits) if len(group)
+            ]
+        return self._groups[bucket]
+
+    def batch_cost(self, candidates):
+        """Returns the cost of each hospital set in `candidates`.
+
+        `candidates` is a (sets x hospitals x 2) array of (row, col) pairs;
+        all sets must contain the same number of hospitals.
+        """
+        candidates = np.asarray(candidates, dtype=np.int64)
+        num_sets, num_hospitals = candidates.shape[:2]
+        costs = np.zeros(num_sets, dtype=np.int64)
+        if len(self.rows) == 0 or num_sets == 0:
+            return costs
+
+        step = max(1, self.BLOCK_SIZE // (len(self.rows) * num_hospitals))
+        for start in range(0, num_sets, step):
+            block = candidates[start:start + step]
+            dist = (
+                np.abs(self.rows[None, :, None] - block[:, None, :, 0])
+                + np.abs(self.cols[None, :, None] - block[:, None, :, 1])
+            )
+            costs[start:start + step] = dist.min(axis=2).sum(axis=1)
+        return costs
+
+
+class HospitalIndex():
+
+    def __init__(self, engine, hospitals, bucket=None):
+        """Bucket hospitals on a grid of `bucket` x `bucket` squares.
+
+        The default bucket size leaves roughly one hospital per square over
+        the area spanned by houses and hospitals.
+        """
+        self.engine = engine
+        self.hospitals = list(hospitals)
+        self.coords = np.array(self.hospitals, dtype=np.int64).reshape(-1, 2)
+        if bucket is None:
+            rows = np.concatenate([engine.rows, self.coords[:, 0]])
+            cols = np.concatenate([engine.cols, self.coords[:, 1]])
+            area = (np.ptp(rows) + 1) * (np.ptp(cols) + 1) if len(rows) else 1
+            bucket = max(1, int(np.sqrt(area / max(1, len(self.hospitals)))))
+        self.bucket = bucket
+        self.buckets = {}
+        self.position = {}
+        for j, cell in enumerate(self.hospitals):
+            self.buckets.setdefault(self.key(cell), set()).add(j)
+            self.position[cell] = j
+
+    def key(self, cell):
+        """Grid square holding `cell`."""
+        return (cell[0] // self.bucket, cell[1] // self.bucket)
+
+    def move(self, index, cell):
+        """Moves hospital `index` to `cell` in O(1)."""
+        old = self.key(self.hospitals[index])
+        self.buckets[old].discard(index)
+        if not self.buckets[old]:
+            del self.buckets[old]
+        self.buckets.setdefault(self.key(cell), set()).add(index)
+        del self.position[self.hospitals[index]]
+        self.position[cell] = index
+        self.hospitals[index] = cell
+        self.coords[index] = cell
+
+    def add(self, cell):
+        """Adds a hospital at `cell` as the last index."""
+        index = len(self.hospitals)
+        self.buckets.setdefault(self.key(cell), set()).add(index)
+        self.position[cell] = index
+        self.hospitals.append(cell)
+        self.coords = np.vstack([self.coords, [cell]])
+
+    def ring(self, top, left, bottom, right, radius):
+        """Hospitals in squares at Chebyshev distance `radius` from the
+        block of squares top..bottom x left..right."""
+        found = []
+        for row in range(top - radius, bottom + radius + 1):
+            if radius and top - radius < row < bottom + radius:
+                cols = (left - radius, right + radius)
+            else:
+                cols = range(left - radius, right + radius + 1)
+            for col in cols:
+                found.extend(self.buckets.get((row, col), ()))
+        return found
+
+    def search(self, top, left, bottom, right, group, needed):
+        """Hospitals around a block of squares for the houses in `group`.
+
+        The houses must lie in squares top..bottom x left..right. Widens the
+        ring of searched squares until no unsearched hospital can be closer
+        than the `needed`-th nearest one found, so every hospital within
+        that distance is returned. Returns the hospitals found, the
+        (houses x found) distances and the `needed`-th nearest distance.
+        """
+        engine = self.engine
+        candidates = []
+        radius = 0
+        while True:
+            candidates.extend(self.ring(top, left, bottom, right, radius))
+            if len(candidates) >= needed:
+                found = np.array(candidates)
+                dist = (
+                    np.abs(engine.rows[group, None]
+                           - self.coords[None, found, 0])
+                    + np.abs(engine.cols[group, None]
+                             - self.coords[None, found, 1])
+                )
+                bound = np.partition(dist, needed - 1, axis=1)[:, needed - 1]
+                # Squares outside the ring are more than
+                # radius * bucket away from every house in the block
+                if (len(candidates) == len(self.hospitals)
+                        or bound.max() <= radius * self.bucket):
+                    return found, dist, bound
+            radius += 1
+
+    def nearest(self, ties=True):
+        """Same bookkeeping as CostEngine.assign, using the buckets.
+
+        Houses are processed one square at a time, widening the ring of
+        searched squares until no unsearched hospital can be closer than
+        the current second-nearest one.
+        """
+        engine = self.engine
+        houses, count = len(engine.rows), len(self.hospitals)
+        needed = min(2, count)
+        nearest = np.zeros(houses, dtype=np.int64)
+        first = np.zeros(houses, dtype=np.int64)
+        second = np.full(houses, engine.FAR, dtype=np.int64)
+        tied_houses, tied_hospitals = [], []
+
+        for (row, col), group in engine.groups(self.bucket):
+            found, dist, bound = self.search(row, col, row, col, group, needed)
+            closest = dist.argmin(axis=1)
+            nearest[group] = found[closest]
+            first[group] = dist[np.arange(len(group)), closest]
+            if needed == 2:
+                second[group] = bound
+            if ties:
+                pair_houses, pair_hospitals = np.nonzero(
+                    dist == first[group, None]
+                )
+                tied_houses.append(group[pair_houses])
+                tied_hospitals.append(found[pair_hospitals])
+
+        affected = None
+        if ties:
+            tied_houses = np.concatenate(tied_houses or [np.zeros(0, np.int64)])
+            tied_hospitals = np.concatenate(
+                tied_hospitals or [np.zeros(0, np.int64)]
+            )
+            order = np.argsort(tied_hospitals, kind="stable")
+            splits = np.cumsum(np.bincount(tied_hospitals, minlength=count))
+            affected = np.split(tied_houses[order], splits[:-1])
+        return nearest, first, second, affected
+
+
+class MoveEvaluator():
+
+    def __init__(self, engine, hospitals, index=None):
+        """Track nearest and second-nearest hospital distances per house.
+
+        `index` is a HospitalIndex over `hospitals` (usually Space.index) and
+        fixes their order. Its owner may move it before calling move().
+        """
+        self.engine = engine
+        self.evaluations = 0
+        if index is None and engine.use_index(len(hospitals)):
+            index = HospitalIndex(engine, hospitals)
+        self.index = index
+        if index is None:
+            self.hospitals = list(hospitals)
+        else:
+            self.hospitals = list(index.hospitals)
+            # Houses by index square, to find those near a moved hospital
+            self.squares = engine.groups(index.bucket)
+            self.square = {key: s for s, (key, _) in enumerate(self.squares)}
+            self.keys = np.array(
+                [key for key, _ in self.squares], dtype=np.int64
+            ).reshape(-1, 2)
+            self.house_square = np.zeros(len(engine.rows), dtype=np.int64)
+            for s, (_, group) in enumerate(self.squares):
+                self.house_square[group] = s
+        self.refresh()
+
+    def refresh(self):
+        """Recomputes the per-house bookkeeping."""
+        # A one-cell move of hospital j changes the distance to j by exactly
+        # one, so only houses for which j is (one of) the nearest can change;
+        # self.affected[j] lists exactly those houses.
+        self.nearest, self.first, self.second, self.affected = (
+            self.engine.assign(self.hospitals, self.index)
+        )
+        self.cost = int(self.first.sum())
+        if self.index is not None:
+            # Largest second-nearest distance among the houses of a square
+            self.reach = np.array(
+                [self.second[group].max() for _, group in self.squares],
+                dtype=np.int64
+            )
+
+    def delta(self, index, cell):
+        """Cost change of moving hospital `index` one cell to `cell`."""
+        self.evaluations += 1
+        houses = self.affected[index]
+        if len(houses) == 0:
+            return 0
+        dist = (
+            np.abs(self.engine.rows[houses] - cell[0])
+            + np.abs(self.engine.cols[houses] - cell[1])
+        )
+        fallback = np.where(
+            self.nearest[houses] == index,
+            self.second[houses],
+            self.first[houses]
+        )
+        return int(
+            np.minimum(fallback, dist).sum() - self.first[houses].sum()
+        )
+
+    def move(self, index, cell):
+        """Moves hospital `index` to `cell` and updates the bookkeeping.
+
+        Only houses that had the hospital within their second-nearest
+        distance before the move, or have it there after, can change; those
+        are recomputed and the rest are kept. With an index, both steps only
+        look at the squares around the old and new cells.
+        """
+        engine = self.engine
+        old = self.hospitals[index]
+        self.hospitals[index] = cell
+        if self.index is not None and self.index.hospitals[index] != cell:
+            self.index.move(index, cell)
+
+        houses = self._nearby(old, cell)
+        near = slice(None) if houses is None else houses
+        rows, cols = engine.rows[near], engine.cols[near]
+        second = self.second[near]
+        reached = (
+            (np.abs(rows - old[0]) + np.abs(cols - old[1]) <= second)
+            | (np.abs(rows - cell[0]) + np.abs(cols - cell[1]) <= second)
+        )
+        houses = np.flatnonzero(reached) if houses is None else houses[reached]
+        if len(houses) == 0:
+            return
+
+        # The other hospitals kept their distances and none was closer than
+        # the old nearest one, so those tied for nearest before are within the
+        # new second-nearest distance and the searches below find them
+        recomputed = np.zeros(len(engine.rows), dtype=bool)
+        recomputed[houses] = True
+        touched = [np.array([index])]
+        tied_houses, tied_hospitals = [], []
+        for group, found, dist, bound in self._searches(houses, old, cell):
+            closest = dist.argmin(axis=1)
+            first = dist[np.arange(len(group)), closest]
+            old_first = self.first[group]
+            touched.append(found[np.nonzero(dist == old_first[:, None])[1]])
+            pair_houses, pair_hospitals = np.nonzero(dist == first[:, None])
+            tied_houses.append(group[pair_houses])
+            tied_hospitals.append(found[pair_hospitals])
+
+            self.cost += int(first.sum() - old_first.sum())
+            self.nearest[group] = found[closest]
+            self.first[group] = first
+            if len(self.hospitals) > 1:
+                self.second[group] = bound
+
+        # Rebuild the tie lists only for hospitals tied before or after
+        tied_houses = np.concatenate(tied_houses)
+        tied_hospitals = np.concatenate(tied_hospitals)
+        for j in np.unique(np.concatenate(touched + [tied_hospitals])):
+            kept = self.affected[j][~recomputed[self.affected[j]]]
+            self.affected[j] = np.concatenate(
+                [kept, tied_houses[tied_hospitals == j]]
+            )
+
+        if self.index is not None:
+            for s in np.unique(self.house_square[houses]):
+                self.reach[s] = self.second[self.squares[s][1]].max()
+
+    def _nearby(self, old, cell):
+        """Houses that may have a hospital moved from `old` to `cell` within
+        their second-nearest distance; None stands for every house."""
+        if self.index is None:
+            return None
+        # A house in a square at Chebyshev distance r >= 1 from a cell's
+        # square is at least (r - 1) * bucket + 1 away from the cell
+        bucket = self.index.bucket
+        radius = (int(self.reach.max()) - 1) // bucket + 1
+        if 2 * (2 * radius + 1) ** 2 >= len(self.squares):
+            return None
+        found = set()
+        for row, col in {self.index.key(old), self.index.key(cell)}:
+            for dr in range(-radius, radius + 1):
+                for dc in range(-radius, radius + 1):
+                    s = self.square.get((row + dr, col + dc))
+                    if s is not None:
+                        found.add(s)
+        return np.concatenate(
+            [self.squares[s][1] for s in found] or [np.zeros(0, np.int64)]
+        )
+
+    def _searches(self, houses, old, cell):
+        """(houses, hospitals, distances, second-nearest distance) blocks
+        covering every hospital within each house's second-nearest one."""
+        engine = self.engine
+        count = len(self.hospitals)
+        if self.index is None:
+            coords = np.array(self.hospitals, dtype=np.int64)
+            dist = (
+                np.abs(engine.rows[houses, None] - coords[None, :, 0])
+                + np.abs(engine.cols[houses, None] - coords[None, :, 1])
+            )
+            kth = min(1, count - 1)
+            bound = np.partition(dist, kth, axis=1)[:, kth]
+            yield houses, np.arange(count), dist, bound
+            return
+
+        # One search over the block of squares around each end of the move,
+        # or a single one when the ends are in the same or adjacent squares
+        keys = self.keys[self.house_square[houses]]
+        ends = np.array([self.index.key(old), self.index.key(cell)])
+        if np.abs(ends[0] - ends[1]).max() <= 1:
+            blocks = [np.arange(len(houses))]
+        else:
+            spread = np.abs(keys[:, None, :] - ends[None, :, :]).max(axis=2)
+            closer = spread.argmin(axis=1)
+            blocks = [np.flatnonzero(closer == end) for end in (0, 1)]
+        for block in blocks:
+            if len(block) == 0:
+                continue
+            top, left = keys[block].min(axis=0)
+            bottom, right = keys[block].max(axis=0)
+            yield (houses[block],) + self.index.search(
+                int(top), int(left), int(bottom), int(right),
+                houses[block], min(2, count)
+            )
+
+
+class LocalSearch(ABC):
+
+    # Iteration budget when tsp_optimize is called without `maximum`
+    default_iterations = 100
+
+    @abstractmethod
+    def run(self, space, evaluator, rng, iterations, apply):
+        """Searches for up to `iterations` steps.
+
+        Candidate moves are scored with `evaluator.delta` and committed with
+        `apply(index, cell, delta)`. Returns the number of steps taken.
+        """
+
+    @staticmethod
+    def moves(space, evaluator):
+        """Every one-cell move as (hospital index, replacement cell)."""
+        for index, hospital in enumerate(evaluator.hospitals):
+            for replacement in space.get_neighbors(*hospital):
+                yield index, replacement
+
+
+class SteepestDescent(LocalSearch):
+
+    def run(self, space, evaluator, rng, iterations, apply):
+        """Takes the best move each step; stops at a local minimum."""
+        count = 0
+        while count < iterations:
+            count += 1
+            best_moves = []
+            best_delta = None
+            for index, replacement in self.moves(space, evaluator):
+                delta = evaluator.delta(index, replacement)
+                if best_delta is None or delta < best_delta:
+                    best_delta = delta
+                    best_moves = [(index, replacement)]
+                elif best_delta == delta:
+                    best_moves.append((index, replacement))
+
+            if best_delta is None or best_delta >= 0:
+                break
+            apply(*rng.choice(best_moves), best_delta)
+        return count
+
+
+class FirstImprovement(LocalSearch):
+
+    def run(self, space, evaluator, rng, iterations, apply):
+        """Takes the first improving move found in a shuffled scan."""
+        count = 0
+        while count < iterations:
+            count += 1
+            moves = list(self.moves(space, evaluator))
+            rng.shuffle(moves)
+            for index, replacement in moves:
+                delta = evaluator.delta(index, replacement)
+                if delta < 0:
+                    apply(index, replacement, delta)
+                    break
+            else:
+                break
+        return count
+
+
+class SimulatedAnnealing(LocalSearch):
+
+    default_iterations = 5000
+
+    def __init__(self, temperature=2.0, cooling=0.995, min_temperature=1e-3):
+        """Geometric cooling from `temperature` down to `min_temperature`."""
+        self.temperature = temperature
+        self.cooling = cooling
+        self.min_temperature = min_temperature
+
+    def run(self, space, evaluator, rng, iterations, apply):
+        """Proposes one random move per step, accepting worse ones with
+        probability exp(-delta / T)."""
+        temperature = self.temperature
+        count = 0
+        while count < iterations:
+            count += 1
+            index = rng.randrange(len(evaluator.hospitals))
+            neighbors = space.get_neighbors(*evaluator.hospitals[index])
+            if neighbors:
+                replacement = rng.choice(neighbors)
+                delta = evaluator.delta(index, replacement)
+                if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+                    apply(index, replacement, delta)
+            temperature = max(self.min_temperature, temperature * self.cooling)
+        return count
+
+
+class TabuSearch(LocalSearch):
+
+    default_iterations = 500
+
+    def __init__(self, tenure=7, patience=50):
+        """Forbid moving a hospital back to a cell for `tenure` steps.
+
+        The search stops after `patience` steps without a new best cost.
+        """
+        self.tenure = tenure
+        self.patience = patience
+
+    def run(self, space, evaluator, rng, iterations, apply):
+        """Takes the best admissible move each step, even if it is worse.
+
+        A tabu move is still admissible when it would beat the best cost
+        seen so far (aspiration).
+        """
+        tabu = {}
+        best_cost = evaluator.cost
+        stale = 0
+        count = 0
+        while count < iterations and stale < self.patience:
+            count += 1
+            best_moves = []
+            best_delta = None
+            for index, replacement in self.moves(space, evaluator):
+                delta = evaluator.delta(index, replacement)
+                if (tabu.get((index, replacement), 0) >= count
+                        and evaluator.cost + delta >= best_cost):
+                    continue
+                if best_delta is None or delta < best_delta:
+                    best_delta = delta
+                    best_moves = [(index, replacement)]
+                elif best_delta == delta:
+                    best_moves.append((index, replacement))
+
+            if best_delta is None:
+                break
+            index, replacement = rng.choice(best_moves)
+            tabu[(index, evaluator.hospitals[index])] = count + self.tenure
+            apply(index, replacement, best_delta)
+
+            if evaluator.cost < best_cost:
+                best_cost = evaluator.cost
+                stale = 0
+            else:
+                stale += 1
+        return count
+
+
+STRATEGIES = {
+    "steepest": SteepestDescent,
+    "first": FirstImprovement,
+    "annealing": SimulatedAnnealing,
+    "tabu": TabuSearch,
+}
+
+
+class OptimizeResult():
+
+    def __init__(self, hospitals, cost, iterations, route=None,
+                 route_distance=None, evaluations=0):
+        """Outcome of one placement run.
+
+        `route` is the TSP visiting order over the hospitals (as cells) and
+        `route_distance` its length; both are None unless routing was asked.
+        `evaluations` counts the candidate moves scored.
+        """
+        self.hospitals = hospitals
+        self.cost = cost
+        self.iterations = iterations
+        self.route = route
+        self.route_distance = route_distance
+        self.evaluations = evaluations
+
+    def __repr__(self):
+        return (
+            f"OptimizeResult(cost={self.cost}, iterations={self.iterations}, "
+            f"hospitals={self.hospitals}, route={self.route})"
+        )
+
+
+def distance_matrix(cells):
+    """Pairwise Manhattan distances between (row, col) cells."""
+    coords = np.array(list(cells), dtype=np.int64).reshape(-1, 2)
+    return np.abs(coords[:, None, :] - coords[None, :, :]).sum(axis=2)
+
+
+class Renderer():
+
+    cell_size = 100
+    cell_border = 2
+    cost_size = 40
+    padding = 10
+
+    def __init__(self, space, max_pending=16):
+        """Load sprites and font once and draw the static background."""
+        from PIL import Image, ImageDraw, ImageFont
+        size = (self.cell_size, self.cell_size)
+        self.house = Image.open(
+            os.path.join(ASSETS_DIR, "images", "House.png")
+        ).convert("RGBA").resize(size)
+        self.hospital = Image.open(
+            os.path.join(ASSETS_DIR, "images", "Hospital.png")
+        ).convert("RGBA").resize(size)
+        self.font = ImageFont.truetype(
+            os.path.join(ASSETS_DIR, "fonts", "OpenSans-Regular.ttf"), 30
+        )
+
+        # Grid and houses never change between frames
+        self.height = space.height
+        self.width = space.width
+        self.background = Image.new(
+            "RGBA",
+            (self.width * self.cell_size,
+             self.height * self.cell_size + self.cost_size + self.padding * 2),
+            "white"
+        )
+        draw = ImageDraw.Draw(self.background)
+        for i in range(self.height):
+            for j in range(self.width):
+                box = self.cell_box(i, j)
+                draw.rectangle(box, fill="black")
+                if (i, j) in space.houses:
+                    self.background.paste(self.house, box[:2], self.house)
+        draw.rectangle(self.cost_box(), "black")
+
+        self.canvas = self.background.copy()
+        self.draw = ImageDraw.Draw(self.canvas)
+        self.drawn = set()
+
+        # PNG encoding happens on a writer thread so callers never wait on it;
+        # at most `max_pending` frames are buffered. A failed write is kept in
+        # `error` and raised from the next render, flush or close.
+        self.frames = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.writer = threading.Thread(target=self._write_frames, daemon=True)
+        self.writer.start()
+
+    def cell_box(self, i, j):
+        """Pixel box (left, top, right, bottom) of the cell at row i, col j."""
+        return (
+            j * self.cell_size + self.cell_border,
+            i * self.cell_size + self.cell_border,
+            (j + 1) * self.cell_size - self.cell_border,
+            (i + 1) * self.cell_size - self.cell_border
+        )
+
+    def cost_box(self):
+        """Pixel box of the band that shows the cost."""
+        return (
+            0, self.height * self.cell_size, self.width * self.cell_size,
+            self.height * self.cell_size + self.cost_size + self.padding * 2
+        )
+
+    def render(self, filename, hospitals, cost):
+        """Redraws the hospitals that changed and queues the frame."""
+        self._raise_error()
+        for i, j in self.drawn - hospitals:
+            box = self.cell_box(i, j)
+            self.canvas.paste(self.background.crop(box), box[:2])
+        for i, j in hospitals - self.drawn:
+            box = self.cell_box(i, j)
+            self.canvas.paste(self.hospital, box[:2], self.hospital)
+        self.drawn = set(hospitals)
+
+        box = self.cost_box()
+        self.canvas.paste(self.background.crop(box), box[:2])
+        self.draw.text(
+            (self.padding, self.height * self.cell_size + self.padding),
+            f"Cost: {cost}",
+            fill="white",
+            font=self.font
+        )
+
+        self.frames.put((self.canvas.copy(), filename))
+
+    def flush(self):
+        """Blocks until every queued frame has been written."""
+        self.frames.join()
+        self._raise_error()
+
+    def close(self):
+        """Writes the queued frames and stops the writer thread."""
+        if self.writer.is_alive():
+            self.frames.put(None)
+            self.writer.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _write_frames(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                self.frames.task_done()
+                return
+            image, filename = frame
+            try:
+                image.save(filename)
+            except Exception as error:
+                # Only the first failure is reported; the thread keeps
+                # draining the queue so flush() never blocks
+                if self.error is None:
+                    self.error = error
+            finally:
+                self.frames.task_done()
+
 
 class Space():
 
+    # Occupancy grid cell values
+    FREE = 0
+    HOUSE = 1
+    HOSPITAL = 2
+
+    # Below this fraction of free cells, sampling scans the grid instead of
+    # drawing random cells until a free one comes up.
+    MIN_FREE_FRACTION = 0.125
+
     def __init__(self, height, width, num_hospitals):
         """Create a new state space with given dimensions."""
         self.height = height
         self.width = width
         self.num_hospitals = num_hospitals
+        self.grid = np.zeros((height, width), dtype=np.uint8)
         self.houses = set()
-        self.hospitals = set()
+        self._hospitals = set()
+        self._engine = None
+        self._index = None
+        self._renderer = None
+        self._routes = {}
+
+    def __getstate__(self):
+        # The renderer owns a writer thread and is rebuilt on demand
+        state = self.__dict__.copy()
+        state["_renderer"] = None
+        return state
 
     def add_house(self, row, col):
         """Add a house at a particular location in state space."""
         self.houses.add((row, col))
+        self.grid[row, col] = self.HOUSE
+        self._engine = None
+        self._index = None
+        if self._renderer is not None:
+            renderer, self._renderer = self._renderer, None
+            renderer.close()
 
-    def available_spaces(self):
-        """Returns all cells not currently used by a house or hospital."""
-
-
-        candidates = set(
-            (row, col)
-            for row in range(self.height)
-            for col in range(self.width)
-        )
+    @property
+    def hospitals(self):
+        """Cells currently holding a hospital."""
+        return self._hospitals
 
-        for house in self.houses:
-            candidates.remove(house)
-        for hospital in self.hospitals:
-            candidates.remove(hospital)
-        return candidates
+    @hospitals.setter
+    def hospitals(self, hospitals):
+        for row, col in self._hospitals:
+            self.grid[row, col] = self.FREE
+        self._hospitals = hospitals
+        self._index = None
+        for row, col in hospitals:
+            self.grid[row, col] = self.HOSPITAL
 
-    def tsp_optimize(self, maximum=None, image_prefix=None, log=False):
-        """Performs TSP-based optimization to find hospital placement solution."""
-        count = 0
+    def place_hospital(self, cell):
+        """Adds a hospital at a free cell."""
+        self._hospitals.add(cell)
+        self.grid[cell] = self.HOSPITAL
+        if self._index is not None:
+            self._index.add(cell)
 
+    def move_hospital(self, old, new):
+        """Moves the hospital at `old` to the free cell `new`."""
+        self._hospitals.remove(old)
+        self.grid[old] = self.FREE
+        self._hospitals.add(new)
+        self.grid[new] = self.HOSPITAL
+        if self._index is not None:
+            self._index.move(self._index.position[old], new)
 
-        self.hospitals = set()
-        for i in range(self.num_hospitals):
-            self.hospitals.add(random.choice(list(self.available_spaces())))
-        if log:
-            print("Initial state: cost", self.get_cost(self.hospitals))
-        if image_prefix:
-            self.output_image(f"{image_prefix}{str(count).zfill(3)}.png")
+    def is_free(self, row, col):
+        """Whether a cell is inside the grid and holds neither building."""
+        return (
+            0 <= row < self.height and 0 <= col < self.width
+            and self.grid[row, col] == self.FREE
+        )
 
+    @property
+    def engine(self):
+        """Vectorized cost engine over the current houses."""
+        if self._engine is None:
+            self._engine = CostEngine(self.houses)
+        return self._engine
 
-        hospitals_list = list(self.hospitals)
-        n = len(hospitals_list)
-        distance_matrix = np.zeros((n, n))
+    @property
+    def index(self):
+        """HospitalIndex kept in step with the current hospitals.
 
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    h1 = hospitals_list[i]
-                    h2 = hospitals_list[j]
+        None while the engine answers faster from the dense distance matrix.
+        """
+        if self._index is None and self.engine.use_index(len(self._hospitals)):
+            self._index = HospitalIndex(self.engine, self._hospitals)
+        return self._index
 
-                    distance_matrix[i][j] = abs(h1[0] - h2[0]) + abs(h1[1] - h2[1])
+    def available_spaces(self):
+        """Returns all cells not currently used by a house or hospital."""
+        return set(map(tuple, np.argwhere(self.grid == self.FREE).tolist()))
 
+    def random_free_cell(self, rng=None):
+        """Samples a cell not used by a house or hospital uniformly."""
+        rng = rng if rng is not None else random
+        free = self.grid.size - len(self.houses) - len(self._hospitals)
+        if free <= 0:
+            raise ValueError("No free cells left in the space")
 
-        orden, distancia_total = solve_sa(distance_matrix)
+        if free >= self.MIN_FREE_FRACTION * self.grid.size:
+            while True:
+                row = rng.randrange(self.height)
+                col = rng.randrange(self.width)
+                if self.grid[row, col] == self.FREE:
+                    return (row, col)
 
-        if log:
-            print(f"TSP Solution: Best order {orden}, Total distance: {distancia_total}")
+        cells = np.flatnonzero(self.grid.ravel() == self.FREE)
+        row, col = divmod(int(cells[rng.randrange(len(cells))]), self.width)
+        return (row, col)
 
+    def nearest_free_cell(self, cell):
+        """Returns the free cell closest (in L1) to `cell`, itself included."""
+        row, col = cell
+        for radius in range(self.height + self.width):
+            for dr in range(-radius, radius + 1):
+                dc = radius - abs(dr)
+                if self.is_free(row + dr, col + dc):
+                    return (row + dr, col + dc)
+                if dc and self.is_free(row + dr, col - dc):
+                    return (row + dr, col - dc)
+        raise ValueError("No free cells left in the space")
 
-        max_iterations = maximum if maximum is not None else 100
-        while count < max_iterations:
-            count += 1
-            best_neighbors = []
-            best_neighbor_cost = None
+    def route(self, hospitals):
+        """Solves the TSP tour over `hospitals`, cached per hospital set.
 
+        Returns the hospitals in visiting order and the tour length.
+        """
+        key = frozenset(hospitals)
+        if key not in self._routes:
+            cells = sorted(key)
+            order, distance = solve_sa(distance_matrix(cells).astype(float))
+            self._routes[key] = ([cells[i] for i in order], distance)
+        return self._routes[key]
 
-            for hospital in self.hospitals:
-
-                for replacement in self.get_neighbors(*hospital):
+    def _result(self, iterations, route, log):
+        """Packs the current hospitals into an OptimizeResult."""
+        result = OptimizeResult(
+            self.hospitals, self.get_cost(self.hospitals), iterations
+        )
+        if route:
+            result.route, result.route_distance = self.route(self.hospitals)
+            if log:
+                print(f"TSP Solution: Best order {result.route}, "
+                      f"Total distance: {result.route_distance}")
+        return result
 
+    def tsp_optimize(self, maximum=None, image_prefix=None, log=False, rng=None,
+                     route=False, strategy="steepest"):
+        """Performs TSP-based optimization to find hospital placement solution.
 
-                    neighbor = self.hospitals.copy()
-                    neighbor.remove(hospital)
-                    neighbor.add(replacement)
+        `rng` is a `random.Random` used for every random choice; the global
+        `random` module is used when it is omitted. `strategy` is a
+        LocalSearch or a key of STRATEGIES; `maximum` is its step budget.
+        With `route=True` the TSP tour over the final hospitals is attached
+        to the returned OptimizeResult.
+        """
+        rng = rng if rng is not None else random
+        if isinstance(strategy, str):
+            strategy = STRATEGIES[strategy]()
+        count = 0
 
 
-                    cost = self.get_cost(neighbor)
-                    if best_neighbor_cost is None or cost < best_neighbor_cost:
-                        best_neighbor_cost = cost
-                        best_neighbors = [neighbor]
-                    elif best_neighbor_cost == cost:
-                        best_neighbors.append(neighbor)
+        self.hospitals = set()
+        for i in range(self.num_hospitals):
+            self.place_hospital(self.random_free_cell(rng))
+        if log:
+            print("Initial state: cost", self.get_cost(self.hospitals))
+        if image_prefix:
+            self.output_image(
+                f"{image_prefix}{str(count).zfill(3)}.png", wait=False
+            )
 
 
-            if best_neighbor_cost >= self.get_cost(self.hospitals):
-                return self.hospitals
+        evaluator = MoveEvaluator(self.engine, self.hospitals, self.index)
+        best = (evaluator.cost, list(evaluator.hospitals))
+        moves = 0
 
+        def apply(index, replacement, delta):
+            nonlocal best, moves
+            moves += 1
+            if log:
+                if delta < 0:
+                    print(f"Found better neighbor: cost {evaluator.cost + delta}")
+                else:
+                    print(f"Moved to neighbor: cost {evaluator.cost + delta}")
+            self.move_hospital(evaluator.hospitals[index], replacement)
+            evaluator.move(index, replacement)
+            if evaluator.cost < best[0]:
+                best = (evaluator.cost, list(evaluator.hospitals))
 
-            else:
-                if log:
-                    print(f"Found better neighbor: cost {best_neighbor_cost}")
-                self.hospitals = random.choice(best_neighbors)
+            if image_prefix:
+                self.output_image(
+                    f"{image_prefix}{str(moves).zfill(3)}.png",
+                    cost=evaluator.cost,
+                    wait=False
+                )
 
+        max_iterations = (
+            maximum if maximum is not None else strategy.default_iterations
+        )
+        count = strategy.run(self, evaluator, rng, max_iterations, apply)
 
-            if image_prefix:
-                self.output_image(f"{image_prefix}{str(count).zfill(3)}.png")
+        # Annealing and tabu search may end away from the best state seen
+        if best[0] < evaluator.cost:
+            self.hospitals = set(best[1])
 
-        return self.hospitals
+        if image_prefix:
+            self.renderer.flush()
+        result = self._result(count, route, log)
+        result.evaluations = evaluator.evaluations
+        return result
 
-    def random_restart(self, maximum, image_prefix=None, log=False):
+    def random_restart(self, maximum, image_prefix=None, log=False,
+                       strategy="steepest"):
         """Repeats TSP-based optimization multiple times."""
         best_hospitals = None
         best_cost = None
 
 
         for i in range(maximum):
-            hospitals = self.tsp_optimize()
+            hospitals = self.tsp_optimize(strategy=strategy).hospitals
             cost = self.get_cost(hospitals)
             if best_cost is None or cost < best_cost:
                 best_cost = cost
@@ -125,19 +979,179 @@ class Space():
                     print(f"{i}: Found state: cost {cost}")
 
             if image_prefix:
-                self.output_image(f"{image_prefix}{str(i).zfill(3)}.png")
+                self.output_image(
+                    f"{image_prefix}{str(i).zfill(3)}.png",
+                    cost=cost,
+                    wait=False
+                )
 
+        if image_prefix:
+            self.renderer.flush()
         return best_hospitals
 
+    def parallel_restart(self, maximum, workers=None, seed=None,
+                         target_cost=None, log=False, strategy="steepest"):
+        """Runs `maximum` independent restarts on a process pool.
+
+        Restart `i` is seeded from the `i`-th value drawn from a generator
+        seeded with `seed`, so a given restart always reproduces the same
+        hospitals; ties in cost are broken by the lowest restart index.
+        Pending restarts are cancelled once a restart reaches `target_cost`.
+        Returns the best hospitals and a dict with per-restart statistics.
+        """
+        master = random.Random(seed)
+        seeds = [master.getrandbits(64) for _ in range(maximum)]
+        costs = {}
+        best = None
+        cancelled = 0
+        recorded = set()
+
+        def record(future):
+            nonlocal best
+            recorded.add(future)
+            i, hospitals, cost = future.result()
+            costs[i] = cost
+            if best is None or (cost, i) < (best[0], best[1]):
+                best = (cost, i, hospitals)
+                if log:
+                    print(f"{i}: Found new best state: cost {cost}")
+            elif log:
+                print(f"{i}: Found state: cost {cost}")
+            return cost
+
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_restart_worker,
+            initargs=(self,)
+        )
+        try:
+            futures = [
+                executor.submit(_restart_worker, i, restart_seed, strategy)
+                for i, restart_seed in enumerate(seeds)
+            ]
+            for future in as_completed(futures):
+                cost = record(future)
+                if target_cost is not None and cost <= target_cost:
+                    cancelled = sum(pending.cancel() for pending in futures)
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        # Restarts already running when the target was reached still finish
+        for future in futures:
+            if future.done() and not future.cancelled() and future not in recorded:
+                record(future)
+
+        values = np.array([costs[i] for i in sorted(costs)])
+        stats = {
+            "seeds": seeds,
+            "costs": costs,
+            "completed": len(costs),
+            "cancelled": cancelled,
+            "best_restart": best[1] if best else None,
+            "best": int(values.min()) if len(values) else None,
+            "worst": int(values.max()) if len(values) else None,
+            "mean": float(values.mean()) if len(values) else None,
+            "std": float(values.std()) if len(values) else None,
+        }
+        return (best[2] if best else None), stats
+
+    def k_medians(self, maximum=50, seeding="kmeans++", image_prefix=None,
+                  log=False, rng=None, route=False):
+        """Places hospitals by Lloyd-style alternation under the L1 metric.
+
+        Houses are assigned to their nearest hospital, then every hospital
+        moves to the coordinate-wise median of its cluster (or the nearest
+        free cell to it). `seeding` is "kmeans++" to spread the initial
+        hospitals over the houses, or "random" for uniform free cells.
+        Returns an OptimizeResult, as tsp_optimize does.
+        """
+        rng = rng if rng is not None else random
+        engine = self.engine
+        count = 0
+
+        self.hospitals = set()
+        if seeding == "kmeans++" and len(engine.rows):
+            self._seed_kmeans_pp(rng)
+        elif seeding in ("kmeans++", "random"):
+            for i in range(self.num_hospitals):
+                self.place_hospital(self.random_free_cell(rng))
+        else:
+            raise ValueError(f"Unknown seeding: {seeding}")
+        centers = list(self.hospitals)
+        if log:
+            print("Initial state: cost", self.get_cost(self.hospitals))
+        if image_prefix:
+            self.output_image(
+                f"{image_prefix}{str(count).zfill(3)}.png", wait=False
+            )
+
+        while count < maximum and len(engine.rows):
+            count += 1
+            dist = engine.distances(centers)
+            assignment = dist.argmin(axis=1)
+            nearest = dist.min(axis=1)
+
+            # Release every hospital before placing the new medians
+            self.hospitals = set()
+            moved = []
+            for j in range(len(centers)):
+                members = np.flatnonzero(assignment == j)
+                if len(members) == 0:
+                    # Empty cluster: restart it at the worst-served house
+                    far = int(nearest.argmax())
+                    target = (int(engine.rows[far]), int(engine.cols[far]))
+                else:
+                    mid = (len(members) - 1) // 2
+                    target = (
+                        int(np.partition(engine.rows[members], mid)[mid]),
+                        int(np.partition(engine.cols[members], mid)[mid])
+                    )
+                cell = self.nearest_free_cell(target)
+                self.place_hospital(cell)
+                moved.append(cell)
+
+            if moved == centers:
+                break
+            centers = moved
+            if log:
+                print(f"Iteration {count}: cost {self.get_cost(self.hospitals)}")
+            if image_prefix:
+                self.output_image(
+                    f"{image_prefix}{str(count).zfill(3)}.png", wait=False
+                )
+
+        if image_prefix:
+            self.renderer.flush()
+        return self._result(count, route, log)
+
+    def _seed_kmeans_pp(self, rng):
+        """Picks hospitals with probability proportional to house distance."""
+        engine = self.engine
+        first = rng.randrange(len(engine.rows))
+        self.place_hospital(self.nearest_free_cell(
+            (int(engine.rows[first]), int(engine.cols[first]))
+        ))
+        for i in range(1, self.num_hospitals):
+            weights = np.cumsum(engine.distances(self.hospitals).min(axis=1))
+            if weights[-1] == 0:
+                self.place_hospital(self.random_free_cell(rng))
+                continue
+            pick = int(np.searchsorted(weights, rng.random() * weights[-1],
+                                       side="right"))
+            self.place_hospital(self.nearest_free_cell(
+                (int(engine.rows[pick]), int(engine.cols[pick]))
+            ))
+
     def get_cost(self, hospitals):
         """Calculates sum of distances from houses to nearest hospital."""
-        cost = 0
-        for house in self.houses:
-            cost += min(
-                abs(house[0] - hospital[0]) + abs(house[1] - hospital[1])
-                for hospital in hospitals
-            )
-        return cost
+        if hospitals is self._hospitals:
+            return self.engine.cost(hospitals, self.index)
+        return self.engine.cost(hospitals)
+
+    def get_costs(self, candidates):
+        """Calculates the cost of many candidate hospital sets in one call."""
+        return self.engine.batch_cost([list(c) for c in candidates])
 
     def get_neighbors(self, row, col):
         """Returns neighbors not already containing a house or hospital."""
@@ -147,74 +1161,47 @@ class Space():
             (row, col - 1),
             (row, col + 1)
         ]
-        neighbors = []
-        for r, c in candidates:
-            if (r, c) in self.houses or (r, c) in self.hospitals:
-                continue
-            if 0 <= r < self.height and 0 <= c < self.width:
-                neighbors.append((r, c))
-        return neighbors
+        return [(r, c) for r, c in candidates if self.is_free(r, c)]
 
-    def output_image(self, filename):
-        """Generates image with all houses and hospitals."""
-        from PIL import Image, ImageDraw, ImageFont
-        cell_size = 100
-        cell_border = 2
-        cost_size = 40
-        padding = 10
+    @property
+    def renderer(self):
+        """Image renderer with cached assets for the current houses."""
+        if self._renderer is None:
+            self._renderer = Renderer(self)
+        return self._renderer
 
+    def output_image(self, filename, cost=None, wait=True):
+        """Generates image with all houses and hospitals.
 
-        img = Image.new(
-            "RGBA",
-            (self.width * cell_size,
-             self.height * cell_size + cost_size + padding * 2),
-            "white"
-        )
-        house = Image.open("assets/images/House.png").resize(
-            (cell_size, cell_size)
-        )
-        hospital = Image.open("assets/images/Hospital.png").resize(
-            (cell_size, cell_size)
-        )
-        font = ImageFont.truetype("assets/fonts/OpenSans-Regular.ttf", 30)
-        draw = ImageDraw.Draw(img)
+        Pass `cost` when it is already known to skip recomputing it. With
+        `wait=False` the frame is encoded in the background; call
+        `renderer.flush()` before relying on the file.
+        """
+        if cost is None:
+            cost = self.get_cost(self.hospitals)
+        self.renderer.render(filename, set(self.hospitals), cost)
+        if wait:
+            self.renderer.flush()
 
-        for i in range(self.height):
-            for j in range(self.width):
 
+def _init_restart_worker(space):
+    """Keeps one copy of the space per worker process."""
+    global _worker_space
+    _worker_space = space
 
-                rect = [
-                    (j * cell_size + cell_border,
-                     i * cell_size + cell_border),
-                    ((j + 1) * cell_size - cell_border,
-                     (i + 1) * cell_size - cell_border)
-                ]
-                draw.rectangle(rect, fill="black")
-
-                if (i, j) in self.houses:
-                    img.paste(house, rect[0], house)
-                if (i, j) in self.hospitals:
-                    img.paste(hospital, rect[0], hospital)
-
-
-        draw.rectangle(
-            (0, self.height * cell_size, self.width * cell_size,
-             self.height * cell_size + cost_size + padding * 2),
-            "black"
-        )
-        draw.text(
-            (padding, self.height * cell_size + padding),
-            f"Cost: {self.get_cost(self.hospitals)}",
-            fill="white",
-            font=font
-        )
 
-        img.save(filename)
+def _restart_worker(index, seed, strategy):
+    """Runs a single seeded restart inside a worker process."""
+    result = _worker_space.tsp_optimize(
+        rng=random.Random(seed), strategy=strategy
+    )
+    return index, result.hospitals, result.cost
 
 
-s = Space(height=10, width=20, num_hospitals=3)
-for i in range(15):
-    s.add_house(random.randrange(s.height), random.randrange(s.width))
+if __name__ == "__main__":
+    s = Space(height=10, width=20, num_hospitals=3)
+    for i in range(15):
+        s.add_house(random.randrange(s.height), random.randrange(s.width))
 
 
-hospitals = s.tsp_optimize(image_prefix="hospitals", log=True)
+    result = s.tsp_optimize(image_prefix="hospitals", log=True, route=True)
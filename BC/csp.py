@@ -0,0 +1,1100 @@
+"""
+Motor CSP reutilizable para colorear mapas
+
+Las variables, la adyacencia y la paleta se pasan al construir el objeto o
+se cargan desde archivos (JSON, CSV o GeoJSON), de modo que varias
+instancias pueden convivir en el mismo proceso.
+"""
+
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import csv
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import time
+
+DEFAULT_COLORS = ["Verde", "Azul", "Amarillo", "Rojo"]
+
+# Configuraciones que prueba solve_portfolio por defecto; las que llevan
+# seed usan reinicios aleatorizados
+DEFAULT_PORTFOLIO = [
+    {"var_heuristic": "mrv", "val_heuristic": "lcv", "use_arc3": True, "use_mac": True},
+    {"var_heuristic": "domwdeg", "val_heuristic": "none", "use_arc3": True, "use_mac": True},
+    {"var_heuristic": "degree", "val_heuristic": "lcv", "use_arc3": True, "use_mac": True},
+    {"var_heuristic": "none", "val_heuristic": "none", "use_arc3": False, "use_mac": True},
+    {"var_heuristic": "mrv", "val_heuristic": "lcv", "use_arc3": True, "use_mac": True, "seed": 1},
+    {"var_heuristic": "domwdeg", "val_heuristic": "lcv", "use_arc3": True, "use_mac": True, "seed": 2},
+]
+
+
+class SearchCancelled(Exception):
+    """La búsqueda se detuvo desde fuera (otra configuración ganó)"""
+
+
+class SearchCutoff(Exception):
+    """Se agotó el límite de retrocesos de un reinicio"""
+
+
+class MapColoringCSP:
+
+    def __init__(self, variables, constraints, colors=None):
+        self.variables = list(variables)
+        self.colors = list(colors or DEFAULT_COLORS)
+
+        # Cada color ocupa un bit; el dominio de una variable es una máscara
+        self.color_bit = {color: 1 << i for i, color in enumerate(self.colors)}
+        self.full_domain = (1 << len(self.colors)) - 1
+
+        known = set(self.variables)
+        seen = set()
+        self.constraints = []
+        for (x, y) in constraints:
+            if x not in known or y not in known:
+                raise ValueError(f"Restricción con región desconocida: {(x, y)}")
+            # x != y es simétrica: (x, y) y (y, x) son la misma restricción
+            key = frozenset((x, y))
+            if x == y or key in seen:
+                continue
+            seen.add(key)
+            self.constraints.append((x, y))
+
+        self.neighbors = self.build_neighbors()
+        self.stats = {'steps': 0, 'backtracks': 0, 'assignments': 0}
+        self.propagator = ArcPropagator(self)
+
+        # Búsqueda aleatorizada con reinicios y cancelación externa
+        self.rng = None
+        self.cutoff = None
+        self.restarts = 0
+        self.stop = None
+        # SolveMetrics activo (ver instrument)
+        self.metrics = None
+
+    # ------------------------------------------------------------------
+    # Carga desde archivos
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def load(cls, path, colors=None, **kwargs):
+        """Elige el cargador según la extensión del archivo"""
+        ext = os.path.splitext(path)[1].lower()
+        if ext in (".geojson",):
+            return cls.from_geojson(path, colors, **kwargs)
+        if ext == ".json":
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("type") in ("FeatureCollection", "Feature"):
+                return cls.from_geojson(path, colors, **kwargs)
+            return cls.from_dict(data, colors)
+        if ext in (".csv", ".txt"):
+            return cls.from_csv(path, colors, **kwargs)
+        raise ValueError(f"Formato no soportado: {path}")
+
+    @classmethod
+    def from_dict(cls, data, colors=None):
+        """Construye el CSP desde un dict ya decodificado.
+
+        `adjacency` puede ser un dict región -> [vecinos] o una lista de
+        pares; `variables` y `colors` son opcionales.
+        """
+        adjacency = data.get("adjacency", data.get("constraints", []))
+        if isinstance(adjacency, dict):
+            pairs = [(x, y) for x, ys in adjacency.items() for y in ys]
+            names = list(adjacency)
+        else:
+            pairs = [tuple(pair) for pair in adjacency]
+            names = []
+        variables = list(data.get("variables", []))
+        for name in names + [v for pair in pairs for v in pair]:
+            if name not in variables:
+                variables.append(name)
+        return cls(variables, pairs, colors or data.get("colors"))
+
+    @classmethod
+    def from_json(cls, path, colors=None):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f), colors)
+
+    @classmethod
+    def from_csv(cls, path, colors=None, header=False):
+        """Lista de adyacencia: cada fila es una región seguida de sus vecinos"""
+        variables = []
+        pairs = []
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = csv.reader(f)
+            if header:
+                next(rows, None)
+            for row in rows:
+                row = [cell.strip() for cell in row if cell.strip()]
+                if not row or row[0].startswith("#"):
+                    continue
+                for name in row:
+                    if name not in variables:
+                        variables.append(name)
+                pairs.extend((row[0], y) for y in row[1:])
+        return cls(variables, pairs, colors)
+
+    @classmethod
+    def from_geojson(cls, path, colors=None, name_property="name", precision=6):
+        """Dos regiones son vecinas si comparten al menos un segmento de borde.
+
+        Los polígonos deben compartir vértices en la frontera común (datos
+        con topología consistente); tocarse en un solo punto no cuenta.
+        """
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        features = data["features"] if data.get("type") == "FeatureCollection" else [data]
+
+        variables = []
+        owners = {}
+        for feature in features:
+            name = feature["properties"][name_property]
+            if name not in variables:
+                variables.append(name)
+            geometry = feature["geometry"]
+            if geometry["type"] == "Polygon":
+                polygons = [geometry["coordinates"]]
+            elif geometry["type"] == "MultiPolygon":
+                polygons = geometry["coordinates"]
+            else:
+                continue
+            for polygon in polygons:
+                for ring in polygon:
+                    points = [
+                        (round(p[0], precision), round(p[1], precision))
+                        for p in ring
+                    ]
+                    for a, b in zip(points, points[1:]):
+                        if a != b:
+                            owners.setdefault(frozenset((a, b)), set()).add(name)
+
+        pairs = set()
+        for regions in owners.values():
+            regions = sorted(regions)
+            for i, x in enumerate(regions):
+                for y in regions[i + 1:]:
+                    pairs.add((x, y))
+        return cls(variables, sorted(pairs), colors)
+
+    # ------------------------------------------------------------------
+    # Dominios
+    # ------------------------------------------------------------------
+
+    def build_neighbors(self):
+        neighbors = {var: [] for var in self.variables}
+        for (x, y) in self.constraints:
+            neighbors[x].append(y)
+            neighbors[y].append(x)
+        return neighbors
+
+    def reset_stats(self):
+        # Se actualiza en el mismo dict para no invalidar referencias
+        self.stats.update(steps=0, backtracks=0, assignments=0)
+        return self.stats
+
+    @contextmanager
+    def instrument(self, metrics):
+        """Activa `metrics` durante el bloque y al salir le copia stats y
+        las revisiones de arcos hechas dentro"""
+        if metrics is None:
+            yield None
+            return
+        self.metrics = metrics
+        revisions = self.propagator.revisions
+        try:
+            yield metrics
+        finally:
+            metrics.revisions += self.propagator.revisions - revisions
+            metrics.stats = dict(self.stats)
+            self.metrics = None
+
+    def phase(self, name):
+        """Cronometra un bloque en las métricas activas (si las hay)"""
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.phase(name)
+
+    def initialize_domains(self):
+        return {var: self.full_domain for var in self.variables}
+
+    def domain_values(self, mask):
+        """Colores presentes en una máscara de dominio, en el orden de colors"""
+        return [color for color in self.colors if mask & self.color_bit[color]]
+
+    # ------------------------------------------------------------------
+    # Consistencia de arcos
+    # ------------------------------------------------------------------
+
+    def arc3(self, domains):
+        return self.propagator.propagate(domains)
+
+    def maintain_arc_consistency(self, var, value, assignment, domains, trail=None):
+        inferences = {}
+        if not self.propagator.propagate(domains, [var], assignment, inferences, trail):
+            return False
+        return inferences
+
+    @staticmethod
+    def undo(domains, trail, mark):
+        """Devuelve a los dominios los valores podados desde la posición mark"""
+        while len(trail) > mark:
+            var, removed = trail.pop()
+            domains[var] |= removed
+
+    # ------------------------------------------------------------------
+    # Heurísticas
+    # ------------------------------------------------------------------
+
+    def order_domain_values(self, var, assignment, heuristic="none", domains=None):
+        if self.rng is not None and domains:
+            # Orden aleatorio; lcv lo reordena de forma estable (empates al azar)
+            values = self.domain_values(domains[var])
+            self.rng.shuffle(values)
+            if heuristic == "lcv":
+                return self.least_constraining_value(var, assignment, domains, values)
+            return values
+        if heuristic == "none":
+            return self.domain_values(domains[var]) if domains else self.colors
+        elif heuristic == "lcv":
+            return self.least_constraining_value(var, assignment, domains)
+        return self.domain_values(domains[var]) if domains else self.colors
+
+    def least_constraining_value(self, var, assignment, domains, values=None):
+        def count_conflicts(value):
+            bit = self.color_bit[value]
+            conflicts = 0
+            for neighbor in self.neighbors[var]:
+                if neighbor not in assignment:
+                    if domains[neighbor] & bit:
+                        conflicts += 1
+            return conflicts
+        if values is None:
+            values = self.domain_values(domains[var])
+        return sorted(values, key=count_conflicts)
+
+    # ------------------------------------------------------------------
+    # Búsqueda
+    # ------------------------------------------------------------------
+
+    def consistent(self, assignment):
+        for (x, y) in self.constraints:
+            if x not in assignment or y not in assignment:
+                continue
+            if assignment[x] == assignment[y]:
+                return False
+        return True
+
+    def is_value_consistent_with_assignment(self, var, value, assignment):
+        for neighbor in self.neighbors[var]:
+            if neighbor in assignment and assignment[neighbor] == value:
+                return False
+        return True
+
+    def backtrack(self, assignment, var_heuristic="none", val_heuristic="none",
+                  domains=None, use_mac=True, trail=None, order=None):
+        stats = self.stats
+        metrics = self.metrics
+        stats['steps'] += 1
+        if self.stop is not None and stats['steps'] % 256 == 0 and self.stop.is_set():
+            raise SearchCancelled()
+        if self.cutoff is not None and stats['backtracks'] > self.cutoff:
+            raise SearchCutoff()
+        if domains is None:
+            domains = self.initialize_domains()
+        if trail is None:
+            # Pila de (variable, máscara podada); cada nivel deshace solo lo suyo
+            trail = []
+        if order is None:
+            order = VariableOrder(self, domains, assignment, var_heuristic)
+
+        depth = len(assignment)
+        if depth == len(self.variables):
+            if metrics is not None:
+                metrics.event("solution", depth=depth)
+            return assignment
+
+        if metrics is None:
+            var = order.select()
+            values = self.order_domain_values(var, assignment, val_heuristic, domains)
+        else:
+            started = time.perf_counter()
+            var = order.select()
+            values = self.order_domain_values(var, assignment, val_heuristic, domains)
+            metrics.add_time("ordering", time.perf_counter() - started)
+
+        for value in list(values):
+            stats['assignments'] += 1
+
+            if not self.is_value_consistent_with_assignment(var, value, assignment):
+                order.conflict(var, value, assignment)
+                stats['backtracks'] += 1
+                if metrics is not None:
+                    metrics.event("conflict", var=var, value=value, depth=depth)
+                continue
+
+            mark = len(trail)
+
+            assignment[var] = value
+            order.assign(var, value)
+            if metrics is not None:
+                metrics.event("assign", var=var, value=value, depth=depth)
+
+            inference_ok = True
+            inferences = {}
+            if use_mac:
+                if metrics is None:
+                    inferences = self.maintain_arc_consistency(var, value, assignment, domains, trail)
+                else:
+                    started = time.perf_counter()
+                    inferences = self.maintain_arc_consistency(var, value, assignment, domains, trail)
+                    metrics.add_time("propagation", time.perf_counter() - started)
+                    metrics.pruned(depth, trail[mark:])
+                if inferences is False:
+                    inference_ok = False
+                    order.wipeout(*self.propagator.conflict)
+                    if metrics is not None:
+                        metrics.event("wipeout", var=self.propagator.conflict[0], depth=depth)
+                else:
+                    order.update(inferences)
+
+            if inference_ok:
+                result = self.backtrack(assignment, var_heuristic, val_heuristic, domains, use_mac, trail, order)
+                if result is not None:
+                    return result
+
+            del assignment[var]
+            order.unassign(var, value)
+
+            pruned = [v for v, _ in trail[mark:]]
+            self.undo(domains, trail, mark)
+            order.update(pruned)
+
+            stats['backtracks'] += 1
+            if metrics is not None:
+                metrics.event("backtrack", var=var, value=value, depth=depth)
+
+        return None
+
+    def solve(self, var_heuristic="none", val_heuristic="none", use_arc3=False,
+              use_mac=True, seed=None, cutoff=100, growth=1.5, metrics=None):
+        """Resuelve el CSP sin imprimir nada; devuelve la asignación o None
+
+        Con `seed` la búsqueda desempata al azar y se reinicia cada vez que
+        supera `cutoff` retrocesos, multiplicando el límite por `growth`.
+        Con `metrics` (un SolveMetrics) se registran tiempos por fase y, si
+        tiene trace, los eventos del árbol de búsqueda.
+        """
+        with self.instrument(metrics):
+            self.reset_stats()
+            self.restarts = 0
+            domains = self.initialize_domains()
+            if use_arc3:
+                with self.phase("arc3"):
+                    consistent = self.arc3(domains)
+                if not consistent:
+                    return None
+            with self.phase("search"):
+                return self._search(var_heuristic, val_heuristic, domains, use_mac,
+                                    seed, cutoff, growth)
+
+    def _search(self, var_heuristic, val_heuristic, domains, use_mac, seed, cutoff, growth):
+        if seed is None:
+            with recursion_limit(len(self.variables)):
+                return self.backtrack(dict(), var_heuristic, val_heuristic, domains, use_mac)
+
+        self.rng = random.Random(seed)
+        limit = cutoff
+        try:
+            while True:
+                self.cutoff = self.stats['backtracks'] + limit
+                try:
+                    with recursion_limit(len(self.variables)):
+                        return self.backtrack(dict(), var_heuristic, val_heuristic,
+                                              dict(domains), use_mac)
+                except SearchCutoff:
+                    self.restarts += 1
+                    limit = int(limit * growth) + 1
+                    if self.metrics is not None:
+                        self.metrics.event("restart", restarts=self.restarts, cutoff=limit)
+        finally:
+            self.rng = None
+            self.cutoff = None
+
+    def min_conflicts(self, max_steps=100000, seed=None, tabu=10, noise=0.1, initial=None):
+        """Búsqueda local de mínimos conflictos; devuelve la asignación o None.
+
+        Parte de `initial` (o de una coloración voraz) y en cada paso toma al
+        azar una variable en conflicto y le da el color con menos vecinos
+        iguales, que puede ser el que ya tiene. El color que acaba de dejar
+        queda prohibido durante `tabu` pasos salvo que no choque con nadie, y
+        con probabilidad `noise` se elige un color al azar. No demuestra que
+        no haya solución: si tras `max_steps` pasos quedan conflictos
+        devuelve None.
+
+        En stats, steps cuenta pasos, assignments recoloreos y backtracks
+        los movimientos que empeoran la variable elegida.
+        """
+        stats = self.reset_stats()
+        rng = random.Random(seed)
+        variables = self.variables
+        k = len(self.colors)
+        index = {var: i for i, var in enumerate(variables)}
+        adjacency = [[index[n] for n in self.neighbors[var]] for var in variables]
+
+        # counts[i][c]: vecinos de i con el color c; value[i]: color de i (-1 sin color)
+        counts = [[0] * k for _ in variables]
+        value = [-1] * len(variables)
+        # Variables en conflicto; slot[i] es su posición en la lista o -1
+        conflicted = []
+        slot = [-1] * len(variables)
+        # tabu_until[i][c]: paso hasta el que i no puede volver a c
+        tabu_until = [[0] * k for _ in variables]
+
+        def update(i):
+            in_conflict = value[i] >= 0 and counts[i][value[i]] > 0
+            if in_conflict and slot[i] < 0:
+                slot[i] = len(conflicted)
+                conflicted.append(i)
+            elif not in_conflict and slot[i] >= 0:
+                last = conflicted.pop()
+                if last != i:
+                    conflicted[slot[i]] = last
+                    slot[last] = slot[i]
+                slot[i] = -1
+
+        def recolor(i, c):
+            old = value[i]
+            value[i] = c
+            for j in adjacency[i]:
+                row = counts[j]
+                if old >= 0:
+                    row[old] -= 1
+                row[c] += 1
+                if value[j] == c or (old >= 0 and value[j] == old):
+                    update(j)
+            update(i)
+            stats['assignments'] += 1
+
+        for i, var in enumerate(variables):
+            if initial and var in initial:
+                recolor(i, self.colors.index(initial[var]))
+                continue
+            row = counts[i]
+            fewest = min(row)
+            recolor(i, rng.choice([c for c in range(k) if row[c] == fewest]))
+
+        for step in range(1, max_steps + 1):
+            if not conflicted or k < 2:
+                break
+            stats['steps'] += 1
+            if self.stop is not None and step % 256 == 0 and self.stop.is_set():
+                raise SearchCancelled()
+
+            i = conflicted[rng.randrange(len(conflicted))]
+            row = counts[i]
+            current = value[i]
+            if rng.random() < noise:
+                c = rng.randrange(k - 1)
+                if c >= current:
+                    c += 1
+            else:
+                candidates = []
+                best = None
+                for c in range(k):
+                    if c != current and tabu_until[i][c] >= step and row[c] > 0:
+                        continue
+                    if best is None or row[c] < best:
+                        best = row[c]
+                        candidates = [c]
+                    elif row[c] == best:
+                        candidates.append(c)
+                if not candidates:
+                    continue
+                c = candidates[0] if len(candidates) == 1 else rng.choice(candidates)
+                if c == current:
+                    continue
+
+            if row[c] > row[current]:
+                stats['backtracks'] += 1
+            tabu_until[i][current] = step + tabu
+            recolor(i, c)
+
+        if conflicted:
+            return None
+        return {var: self.colors[value[i]] for i, var in enumerate(variables)}
+
+    def solve_portfolio(self, configs=None, workers=None, timeout=None):
+        """Ejecuta varias configuraciones en procesos; gana la primera que termina.
+
+        Cada configuración es un dict de argumentos para solve(). En cuanto
+        una encuentra solución (o demuestra que no la hay) se cancelan las
+        demás. Devuelve la solución y, por configuración, su estado
+        ("solved", "unsat", "cancelled", "timeout" o "error"), stats,
+        reinicios y tiempo.
+        """
+        configs = list(configs or DEFAULT_PORTFOLIO)
+        workers = workers or min(len(configs), multiprocessing.cpu_count())
+        context = multiprocessing.get_context()
+        stop = context.Event()
+        results = context.Queue()
+
+        pending = list(enumerate(configs))
+        running = {}
+        report = [
+            {"config": config, "status": "skipped", "stats": None,
+             "restarts": 0, "seconds": None}
+            for config in configs
+        ]
+        solution = None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Tras parar, margen para que las demás informen sus stats
+        grace = None
+        timed_out = False
+
+        def launch():
+            while pending and len(running) < workers and not stop.is_set():
+                index, config = pending.pop(0)
+                process = context.Process(
+                    target=_portfolio_worker,
+                    args=(self, index, config, stop, results),
+                    daemon=True
+                )
+                process.start()
+                running[index] = process
+
+        try:
+            launch()
+            while running:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline and not stop.is_set():
+                    timed_out = True
+                    stop.set()
+                    grace = now + 1.0
+                if grace is not None and now >= grace:
+                    break
+
+                try:
+                    index, status, found, stats, restarts, seconds = results.get(timeout=0.05)
+                except queue.Empty:
+                    # Un proceso que terminó bien ya dejó su resultado en la cola
+                    for index, process in list(running.items()):
+                        if process.exitcode not in (None, 0):
+                            report[index]["status"] = "error"
+                            del running[index]
+                    launch()
+                    continue
+
+                running.pop(index).join()
+                report[index].update(status=status, stats=stats,
+                                     restarts=restarts, seconds=seconds)
+                if status in ("solved", "unsat") and not stop.is_set():
+                    solution = found
+                    stop.set()
+                    grace = time.monotonic() + 1.0
+                launch()
+        finally:
+            stop.set()
+            for index, process in running.items():
+                process.terminate()
+                process.join()
+                report[index]["status"] = "timeout" if timed_out else "cancelled"
+        return solution, report
+
+    # ------------------------------------------------------------------
+    # Enumeración y conteo de soluciones
+    # ------------------------------------------------------------------
+
+    def iter_solutions(self, var_heuristic="none", val_heuristic="none",
+                       use_arc3=False, use_mac=True):
+        """Genera todas las coloraciones válidas, una a una y bajo demanda.
+
+        Recorre el mismo árbol que backtrack, pero con una pila explícita en
+        lugar de recursión, así que puede pausarse entre soluciones sin
+        importar la profundidad. Cada solución se entrega como un dict nuevo.
+        """
+        self.reset_stats()
+        stats = self.stats
+        domains = self.initialize_domains()
+        if use_arc3 and not self.arc3(domains):
+            return
+        assignment = {}
+        trail = []
+        order = VariableOrder(self, domains, assignment, var_heuristic)
+
+        def retract(var, mark):
+            order.unassign(var, assignment.pop(var))
+            pruned = [v for v, _ in trail[mark:]]
+            self.undo(domains, trail, mark)
+            order.update(pruned)
+            stats['backtracks'] += 1
+
+        # Un nivel por variable: (variable, valores por probar, marca del trail)
+        stack = []
+        descend = True
+        while True:
+            if descend:
+                stats['steps'] += 1
+                if len(assignment) == len(self.variables):
+                    yield dict(assignment)
+                else:
+                    var = order.select()
+                    values = self.order_domain_values(var, assignment, val_heuristic, domains)
+                    stack.append((var, iter(list(values)), len(trail)))
+            if not stack:
+                return
+
+            var, values, mark = stack[-1]
+            if var in assignment:
+                retract(var, mark)
+
+            descend = False
+            for value in values:
+                stats['assignments'] += 1
+                if not self.is_value_consistent_with_assignment(var, value, assignment):
+                    order.conflict(var, value, assignment)
+                    stats['backtracks'] += 1
+                    continue
+
+                assignment[var] = value
+                order.assign(var, value)
+                if use_mac:
+                    inferences = self.maintain_arc_consistency(var, value, assignment, domains, trail)
+                    if inferences is False:
+                        order.wipeout(*self.propagator.conflict)
+                        retract(var, mark)
+                        continue
+                    order.update(inferences)
+                descend = True
+                break
+            if not descend:
+                stack.pop()
+
+    def components(self):
+        """Componentes conexas del grafo de restricciones"""
+        seen = set()
+        components = []
+        for start in self.variables:
+            if start in seen:
+                continue
+            seen.add(start)
+            component = [start]
+            queue = deque([start])
+            while queue:
+                var = queue.popleft()
+                for neighbor in self.neighbors[var]:
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        component.append(neighbor)
+                        queue.append(neighbor)
+            components.append(component)
+        return components
+
+    def count_solutions(self, domains=None):
+        """Número de coloraciones válidas, sin enumerarlas.
+
+        Las componentes conexas son independientes, así que se cuentan por
+        separado y se multiplican. Dentro de cada una se asignan las
+        variables en orden y solo se recuerda la frontera (las ya asignadas
+        con vecinos pendientes): las asignaciones que coinciden en ella se
+        agrupan en un único estado con su número de extensiones.
+
+        El coste crece exponencialmente con el ancho de la frontera (puede
+        haber hasta colores ** ancho estados), así que en mapas grandes y
+        densos contar es mucho más caro que encontrar una solución.
+        """
+        if domains is None:
+            domains = self.initialize_domains()
+        total = 1
+        for component in self.components():
+            total *= self._count_component(component, domains)
+            if total == 0:
+                break
+        return total
+
+    def _count_component(self, component, domains):
+        order = self._frontier_order(component)
+        index = {var: i for i, var in enumerate(order)}
+        # Última posición del orden en la que aparece cada variable o un vecino
+        last_use = {
+            var: max([index[var]] + [index[n] for n in self.neighbors[var]])
+            for var in order
+        }
+
+        # states: colores de la frontera (bits, en orden de la tupla) -> cuenta
+        frontier = []
+        states = {(): 1}
+        for i, var in enumerate(order):
+            # Posiciones en la frontera de los vecinos ya asignados de var
+            adjacent = set(self.neighbors[var])
+            blocking = [k for k, f in enumerate(frontier) if f in adjacent]
+            extended = frontier + [var]
+            kept = [k for k, f in enumerate(extended) if last_use[f] > i]
+
+            new_states = {}
+            for key, count in states.items():
+                blocked = 0
+                for k in blocking:
+                    blocked |= key[k]
+                available = domains[var] & ~blocked
+                while available:
+                    bit = available & -available
+                    available ^= bit
+                    full = key + (bit,)
+                    new_key = tuple(full[k] for k in kept)
+                    new_states[new_key] = new_states.get(new_key, 0) + count
+            if not new_states:
+                return 0
+            states = new_states
+            frontier = [extended[k] for k in kept]
+        return sum(states.values())
+
+    def _frontier_order(self, component):
+        """Orden de máxima cardinalidad: la siguiente variable es la que tiene
+        más vecinos ya ordenados, lo que mantiene la frontera estrecha"""
+        position = {var: i for i, var in enumerate(self.variables)}
+        members = set(component)
+        start = min(component, key=lambda v: (len(self.neighbors[v]), position[v]))
+        ordered_neighbors = {var: 0 for var in component}
+        order = []
+        placed = set()
+        heap = [(0, position[start], start)]
+        while heap:
+            _, _, var = heapq.heappop(heap)
+            if var in placed:
+                continue
+            placed.add(var)
+            order.append(var)
+            for neighbor in self.neighbors[var]:
+                if neighbor in members and neighbor not in placed:
+                    ordered_neighbors[neighbor] += 1
+                    heapq.heappush(heap, (-ordered_neighbors[neighbor], position[neighbor], neighbor))
+        return order
+
+
+def _portfolio_worker(csp, index, config, stop, results):
+    """Resuelve una configuración del portafolio dentro de un proceso"""
+    csp.stop = stop
+    start = time.perf_counter()
+    solution = None
+    try:
+        solution = csp.solve(**config)
+        status = "solved" if solution else "unsat"
+    except SearchCancelled:
+        status = "cancelled"
+    results.put((index, status, solution and dict(solution), dict(csp.stats),
+                 csp.restarts, time.perf_counter() - start))
+
+
+class VariableOrder:
+    """Selección incremental de la siguiente variable a asignar
+
+    Mantiene un heap con entradas perezosas (clave, posición, variable): cada
+    vez que cambia algo que afecta a la clave de una variable se inserta una
+    entrada nueva, y al extraer se descartan las que ya no coinciden con la
+    clave actual. Heurísticas:
+
+    - "none": la primera variable sin asignar, en el orden de `variables`.
+    - "mrv": menos valores legales (dominio vivo sin los colores de vecinos
+      ya asignados).
+    - "degree": más vecinos sin asignar.
+    - "domwdeg": valores legales / suma de pesos de las restricciones con
+      vecinos sin asignar; el peso de una restricción crece cada vez que
+      provoca un fallo.
+    """
+
+    HEURISTICS = ("none", "mrv", "degree", "domwdeg")
+
+    def __init__(self, csp, domains, assignment, heuristic="none"):
+        if heuristic not in self.HEURISTICS:
+            heuristic = "none"
+        self.heuristic = heuristic
+        self.csp = csp
+        self.domains = domains
+        # Desempate entre variables; aleatorio si la búsqueda tiene semilla
+        order = list(csp.variables)
+        if csp.rng is not None:
+            csp.rng.shuffle(order)
+        self.position = {v: i for i, v in enumerate(order)}
+        self.unassigned = set(v for v in csp.variables if v not in assignment)
+
+        # blocked[v][color]: vecinos asignados con ese color
+        self.blocked = {v: {} for v in csp.variables}
+        self.blocked_mask = {v: 0 for v in csp.variables}
+        self.free_degree = {
+            v: sum(1 for n in csp.neighbors[v] if n not in assignment)
+            for v in csp.variables
+        }
+        self.weights = {}
+        self.wdeg = dict(self.free_degree)
+        for var, value in assignment.items():
+            self._block(var, value, 1)
+
+        self.heap = [(self.key(v), v) for v in self.unassigned]
+        heapq.heapify(self.heap)
+
+    def legal(self, var):
+        return (self.domains[var] & ~self.blocked_mask[var]).bit_count()
+
+    def key(self, var):
+        position = self.position[var]
+        if self.heuristic == "mrv":
+            return (self.legal(var), position)
+        if self.heuristic == "degree":
+            return (-self.free_degree[var], position)
+        if self.heuristic == "domwdeg":
+            wdeg = self.wdeg[var]
+            score = self.legal(var) / wdeg if wdeg else float("inf")
+            return (score, position)
+        return (position,)
+
+    def touch(self, var):
+        if var in self.unassigned:
+            heapq.heappush(self.heap, (self.key(var), var))
+
+    def update(self, variables):
+        """Vuelve a encolar variables cuyo dominio cambió"""
+        if self.heuristic in ("mrv", "domwdeg"):
+            for var in variables:
+                self.touch(var)
+
+    def select(self):
+        # La entrada elegida se queda en el heap: si ningún valor funciona la
+        # variable sigue sin asignar y debe poder elegirse otra vez
+        heap = self.heap
+        while heap:
+            key, var = heap[0]
+            if var in self.unassigned and key == self.key(var):
+                return var
+            heapq.heappop(heap)
+        return None
+
+    def weight(self, x, y):
+        return self.weights.get(frozenset((x, y)), 1)
+
+    def _block(self, var, value, step):
+        bit = self.csp.color_bit[value]
+        for n in self.csp.neighbors[var]:
+            count = self.blocked[n].get(bit, 0) + step
+            self.blocked[n][bit] = count
+            if count:
+                self.blocked_mask[n] |= bit
+            else:
+                self.blocked_mask[n] &= ~bit
+            self.free_degree[n] -= step
+            self.wdeg[n] -= step * self.weight(var, n)
+
+    def assign(self, var, value):
+        self.unassigned.discard(var)
+        self._block(var, value, 1)
+        if self.heuristic != "none":
+            for n in self.csp.neighbors[var]:
+                self.touch(n)
+
+    def unassign(self, var, value):
+        self.unassigned.add(var)
+        self._block(var, value, -1)
+        self.touch(var)
+        if self.heuristic != "none":
+            for n in self.csp.neighbors[var]:
+                self.touch(n)
+
+    def wipeout(self, x, y):
+        """Una restricción vació un dominio: aumenta su peso (dom/wdeg)"""
+        if self.heuristic != "domwdeg":
+            return
+        key = frozenset((x, y))
+        self.weights[key] = self.weights.get(key, 1) + 1
+        for var, other in ((x, y), (y, x)):
+            if other in self.unassigned:
+                self.wdeg[var] += 1
+                self.touch(var)
+
+    def conflict(self, var, value, assignment):
+        """El valor choca con un vecino asignado: cuenta como fallo"""
+        if self.heuristic != "domwdeg":
+            return
+        for n in self.csp.neighbors[var]:
+            if assignment.get(n) == value:
+                self.wipeout(var, n)
+                return
+
+
+class ArcPropagator:
+    """AC-3 con cola sin duplicados y soportes residuales (AC-2001)
+
+    La cola guarda variables, no arcos: cuando cambia el dominio de xj se
+    encola xj una sola vez y al sacarla se revisan sus arcos entrantes
+    (xi, xj), indexados por variable. Para cada (xi, valor, xj) se guarda
+    el último soporte encontrado en xj; mientras siga en el dominio de xj no
+    hace falta buscar otro.
+    """
+
+    def __init__(self, csp):
+        self.color_bit = csp.color_bit
+        self.variables = csp.variables
+        # incoming[xj]: variables xi de los arcos (xi, xj)
+        self.incoming = csp.neighbors
+        self.last = {}
+        # Último arco (xi, xj) que vació un dominio
+        self.conflict = None
+        # Llamadas a revise acumuladas
+        self.revisions = 0
+
+    def propagate(self, domains, changed=None, assignment=None, inferences=None, trail=None):
+        """Revisa arcos hasta el punto fijo; False si un dominio queda vacío.
+
+        `changed` son las variables cuyos dominios cambiaron (todas si se
+        omite). Las variables de `assignment` no se podan; lo eliminado se
+        anota en `inferences` y en `trail` si se dan.
+        """
+        assignment = assignment if assignment is not None else {}
+        queue = deque()
+        queued = set()
+        for var in (self.variables if changed is None else changed):
+            if var not in queued:
+                queued.add(var)
+                queue.append(var)
+
+        revisions = 0
+        while queue:
+            xj = queue.popleft()
+            queued.discard(xj)
+            if xj in assignment:
+                dj = self.color_bit[assignment[xj]]
+            else:
+                dj = domains[xj]
+            if dj & (dj - 1):
+                # Con dos o más valores en xj todo x tiene un y != x
+                continue
+            for xi in self.incoming[xj]:
+                if xi in assignment:
+                    continue
+                revisions += 1
+                removed = self.revise(domains[xi], xi, xj, dj)
+                if not removed:
+                    continue
+                domains[xi] &= ~removed
+                if inferences is not None:
+                    # inferences guarda, por variable, la máscara de valores eliminados
+                    inferences[xi] = inferences.get(xi, 0) | removed
+                if trail is not None:
+                    trail.append((xi, removed))
+                if domains[xi] == 0:
+                    self.conflict = (xi, xj)
+                    self.revisions += revisions
+                    return False
+                if xi not in queued:
+                    queued.add(xi)
+                    queue.append(xi)
+        self.revisions += revisions
+        return True
+
+    def revise(self, di, xi, xj, dj):
+        """Máscara de valores de di sin soporte en dj bajo x != y"""
+        last = self.last
+        removed = 0
+        while di:
+            bit = di & -di
+            di ^= bit
+            key = (xi, bit, xj)
+            if last.get(key, 0) & dj:
+                continue
+            # Cualquier valor de xj distinto de x sirve como nuevo soporte
+            support = dj & ~bit
+            if support:
+                last[key] = support & -support
+            else:
+                removed |= bit
+        return removed
+
+
+class SolveMetrics:
+    """Métricas de una resolución.
+
+    - timings: segundos por fase ("arc3", "search", "propagation",
+      "ordering", "render"); las fases se solapan, propagation y ordering
+      son parte de search.
+    - revisions: llamadas a revise del propagador.
+    - pruned_by_depth[d]: valores podados por MAC tras asignar a profundidad d.
+    - stats: copia de steps/backtracks/assignments al terminar.
+
+    `trace` es un callable opcional que recibe cada evento del árbol de
+    búsqueda como dict (assign, conflict, wipeout, backtrack, restart,
+    solution); JsonlTrace los guarda en un archivo.
+    """
+
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.timings = {}
+        self.revisions = 0
+        self.pruned_by_depth = []
+        self.stats = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def pruned(self, depth, removed):
+        """Suma los valores de las entradas (variable, máscara) de removed"""
+        count = sum(bin(mask).count("1") for _, mask in removed)
+        while len(self.pruned_by_depth) <= depth:
+            self.pruned_by_depth.append(0)
+        self.pruned_by_depth[depth] += count
+
+    def event(self, kind, **fields):
+        if self.trace is not None:
+            self.trace({"event": kind, "t": time.perf_counter() - self.started, **fields})
+
+    def as_dict(self):
+        return {
+            "timings": dict(self.timings),
+            "revisions": self.revisions,
+            "pruned_by_depth": list(self.pruned_by_depth),
+            "stats": dict(self.stats),
+        }
+
+
+class JsonlTrace:
+    """Escribe cada evento de SolveMetrics como una línea JSON"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def __call__(self, event):
+        self.file.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class recursion_limit:
+    """Sube el límite de recursión para búsquedas de profundidad ~ depth"""
+
+    def __init__(self, depth):
+        self.limit = max(sys.getrecursionlimit(), 2 * depth + 200)
+
+    def __enter__(self):
+        self.previous = sys.getrecursionlimit()
+        sys.setrecursionlimit(self.limit)
+
+    def __exit__(self, *exc):
+        sys.setrecursionlimit(self.previous)
@@ -2,12 +2,13 @@
 CSP para colorear mapa de Baja California - Versión corregida con OpenCV
 """
 
-from collections import deque
-import time
+import hashlib
 import cv2
 import numpy as np
 import os
 
+from csp import MapColoringCSP, SolveMetrics, recursion_limit
+
 VARIABLES = ["Tijuana", "Rosarito", "Tecate", "Ensenada",
              "Mexicali", "San Felipe", "San Quintin"]
 
@@ -38,204 +39,205 @@ CONSTRAINTS = [
 
 COLORS = ["Verde", "Azul", "Amarillo"]
 
-stats = {
-    'steps': 0,
-    'backtracks': 0,
-    'assignments': 0
+BC_CSP = MapColoringCSP(VARIABLES, CONSTRAINTS, COLORS)
+
+# Nombres de la versión basada en funciones globales
+NEIGHBORS = BC_CSP.neighbors
+stats = BC_CSP.stats
+initialize_domains = BC_CSP.initialize_domains
+domain_values = BC_CSP.domain_values
+arc3 = BC_CSP.arc3
+backtrack = BC_CSP.backtrack
+consistent = BC_CSP.consistent
+
+# Colores BGR (OpenCV usa BGR, no RGB)
+COLOR_BGR = {
+    "Verde": (0, 255, 0),      # Verde brillante
+    "Azul": (255, 0, 0),       # Azul brillante
+    "Amarillo": (0, 255, 255), # Amarillo brillante
+    "Rojo": (0, 0, 255)        # Rojo brillante
 }
 
-def build_neighbors():
-    neighbors = {var: [] for var in VARIABLES}
-    for (x, y) in CONSTRAINTS:
-        if y not in neighbors[x]:
-            neighbors[x].append(y)
-        if x not in neighbors[y]:
-            neighbors[y].append(x)
-    return neighbors
-
-NEIGHBORS = build_neighbors()
-
-def initialize_domains():
-    return {var: COLORS.copy() for var in VARIABLES}
-
-def arc3(domains):
-    queue = deque()
-    for (x, y) in CONSTRAINTS:
-        queue.append((x, y))
-        queue.append((y, x))
-
-    while queue:
-        (xi, xj) = queue.popleft()
-        if revise(domains, xi, xj):
-            if len(domains[xi]) == 0:
-                return False
-            for xk in NEIGHBORS[xi]:
-                if xk != xj:
-                    queue.append((xk, xi))
-    return True
-
-def revise(domains, xi, xj):
-    revised = False
-    to_remove = []
-    for x in domains[xi]:
-        satisfies = False
-        for y in domains[xj]:
-            if x != y:
-                satisfies = True
-                break
-        if not satisfies:
-            to_remove.append(x)
-            revised = True
-    for val in to_remove:
-        domains[xi].remove(val)
-    return revised
-
-def maintain_arc_consistency(var, value, assignment, domains):
-    inferences = {}
-    queue = deque()
-
-    for neighbor in NEIGHBORS[var]:
-        if neighbor not in assignment:
-            queue.append((neighbor, var))
-
-    while queue:
-        (xi, xj) = queue.popleft()
-        if revise_with_assignment(domains, xi, xj, assignment, inferences):
-            if len(domains[xi]) == 0:
-                return False
-            for xk in NEIGHBORS[xi]:
-                if xk != xj and xk not in assignment:
-                    queue.append((xk, xi))
-
-    return inferences
-
-def revise_with_assignment(domains, xi, xj, assignment, inferences):
-    revised = False
-    to_remove = []
-    for x in list(domains[xi]):
-        satisfies = False
-        if xj in assignment:
-            if x != assignment[xj]:
-                satisfies = True
-        else:
-            for y in domains[xj]:
-                if x != y:
-                    satisfies = True
-                    break
-        if not satisfies:
-            to_remove.append(x)
-            revised = True
-    for val in to_remove:
-        if val in domains[xi]:
-            domains[xi].remove(val)
-            if xi not in inferences:
-                inferences[xi] = []
-            inferences[xi].append(val)
-    return revised
-
-def select_unassigned_variable(assignment, heuristic="none", domains=None):
-    unassigned = [v for v in VARIABLES if v not in assignment]
-    if not unassigned:
-        return None
-    if heuristic == "none":
-        return unassigned[0]
-    elif heuristic == "mrv":
-        return minimum_remaining_values(unassigned, assignment, domains)
-    elif heuristic == "degree":
-        return degree_heuristic(unassigned, assignment)
-    return unassigned[0]
-
-def minimum_remaining_values(unassigned, assignment, domains):
-    def count_legal_values(var):
-        count = 0
-        for value in domains[var]:
-            test_assignment = assignment.copy()
-            test_assignment[var] = value
-            if consistent(test_assignment):
-                count += 1
-        return count
-    return min(unassigned, key=count_legal_values)
-
-def degree_heuristic(unassigned, assignment):
-    def count_unassigned_neighbors(var):
-        return sum(1 for n in NEIGHBORS[var] if n not in assignment)
-    return max(unassigned, key=count_unassigned_neighbors)
-
-def order_domain_values(var, assignment, heuristic="none", domains=None):
-    if heuristic == "none":
-        return domains[var] if domains else COLORS
-    elif heuristic == "lcv":
-        return least_constraining_value(var, assignment, domains)
-    return domains[var] if domains else COLORS
-
-def least_constraining_value(var, assignment, domains):
-    def count_conflicts(value):
-        conflicts = 0
-        for neighbor in NEIGHBORS[var]:
-            if neighbor not in assignment:
-                if value in domains[neighbor]:
-                    conflicts += 1
-        return conflicts
-    return sorted(domains[var], key=count_conflicts)
-
-def consistent(assignment):
-    for (x, y) in CONSTRAINTS:
-        if x not in assignment or y not in assignment:
-            continue
-        if assignment[x] == assignment[y]:
-            return False
-    return True
-
-def backtrack(assignment, var_heuristic="none", val_heuristic="none", domains=None, use_mac=True):
-    stats['steps'] += 1
-
-    if len(assignment) == len(VARIABLES):
-        return assignment
-
-    var = select_unassigned_variable(assignment, var_heuristic, domains)
-
-    values = order_domain_values(var, assignment, val_heuristic, domains)
-
-    for value in list(values):
-        stats['assignments'] += 1
-
-        if not is_value_consistent_with_assignment(var, value, assignment):
-            stats['backtracks'] += 1
-            continue
-
-        saved_domains = {v: domains[v].copy() for v in domains}
-
-        assignment[var] = value
-
-        inference_ok = True
-        inferences = {}
-        if use_mac:
-            inferences = maintain_arc_consistency(var, value, assignment, domains)
-            if inferences is False:
-                inference_ok = False
-
-        if inference_ok:
-            result = backtrack(assignment, var_heuristic, val_heuristic, domains, use_mac)
-            if result is not None:
-                return result
-
-        del assignment[var]
-
-        for v in saved_domains:
-            domains[v] = saved_domains[v]
-
-        stats['backtracks'] += 1
-
-    return None
-
-def is_value_consistent_with_assignment(var, value, assignment):
-    for neighbor in NEIGHBORS[var]:
-        if neighbor in assignment and assignment[neighbor] == value:
-            return False
-    return True
+# Diferencia máxima por canal respecto a la semilla, como en floodFill
+FILL_TOLERANCE = 30
+
+# Valor del mapa de etiquetas para píxeles que no pertenecen a ninguna región
+NO_REGION = -1
+
+# Mapas de etiquetas ya calculados en este proceso, por clave de contenido
+_label_maps = {}
+
+
+def default_seed_points(width, height):
+    """Puntos semilla para cada municipio (ajústalo según tu imagen)"""
+    return {
+        "Tijuana": [
+            (int(width * 0.08), int(height * 0.05)),
+            (int(width * 0.09), int(height * 0.08)),
+            (int(width * 0.10), int(height * 0.07)),
+        ],
+        "Rosarito": [
+            (int(width * 0.08), int(height * 0.12)),
+            (int(width * 0.09), int(height * 0.15)),
+            (int(width * 0.07), int(height * 0.14)),
+        ],
+        "Tecate": [
+            (int(width * 0.20), int(height * 0.08)),
+            (int(width * 0.22), int(height * 0.10)),
+            (int(width * 0.18), int(height * 0.09)),
+        ],
+        "Ensenada": [
+            (int(width * 0.12), int(height * 0.25)),
+            (int(width * 0.15), int(height * 0.30)),
+            (int(width * 0.10), int(height * 0.28)),
+            (int(width * 0.13), int(height * 0.35)),
+        ],
+        "Mexicali": [
+            (int(width * 0.40), int(height * 0.08)),
+            (int(width * 0.45), int(height * 0.10)),
+            (int(width * 0.42), int(height * 0.12)),
+            (int(width * 0.38), int(height * 0.11)),
+        ],
+        "San Felipe": [
+            (int(width * 0.45), int(height * 0.35)),
+            (int(width * 0.47), int(height * 0.38)),
+            (int(width * 0.43), int(height * 0.33)),
+        ],
+        "San Quintin": [
+            (int(width * 0.18), int(height * 0.60)),
+            (int(width * 0.20), int(height * 0.65)),
+            (int(width * 0.16), int(height * 0.62)),
+        ]
+    }
+
+
+def label_regions(img, seed_points, tolerance=FILL_TOLERANCE):
+    """Segmenta el mapa una vez y asocia cada región a sus zonas.
+
+    Para cada color de semilla se etiquetan las componentes conexas
+    (4-conectividad) de los píxeles a menos de `tolerance` por canal, que
+    es lo que rellenaría floodFill con FLOODFILL_FIXED_RANGE. Igual que al
+    rellenar en orden sobre la imagen, una semilla en una zona ya pintada
+    se la queda entera y una semilla nueva solo toma píxeles sin pintar;
+    si varias regiones comparten zona gana la última de seed_points.
+
+    Devuelve (regions, names, applied): arreglo int32 con el índice en
+    names de la región de cada píxel (NO_REGION si no se pinta) y semillas
+    aprovechadas por región.
+    """
+    height, width = img.shape[:2]
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    names = list(seed_points)
+    # area[p]: zona pintada a la que pertenece el píxel; owner[zona]: región
+    area = np.full(height * width, -1, np.int32)
+    owner = []
+    applied = {}
+    components = {}
+
+    for index, region in enumerate(names):
+        applied[region] = 0
+        for x, y in seed_points[region]:
+            # Verificar si el píxel es blanco (parte del mapa)
+            if not (0 <= x < width and 0 <= y < height) or gray[y, x] <= 200:
+                continue
+            applied[region] += 1
+            seed = y * width + x
+            if area[seed] >= 0:
+                owner[area[seed]] = index
+                continue
+            seed_color = tuple(int(c) for c in img[y, x])
+            if seed_color not in components:
+                lower = np.clip(np.array(seed_color) - tolerance, 0, 255)
+                upper = np.clip(np.array(seed_color) + tolerance, 0, 255)
+                mask = cv2.inRange(img, lower, upper)
+                components[seed_color] = cv2.connectedComponents(mask, connectivity=4)[1].ravel()
+            labels = components[seed_color]
+            area[(labels == labels[seed]) & (area < 0)] = len(owner)
+            owner.append(index)
+
+    # area == -1 indexa el último elemento, NO_REGION
+    regions = np.array(owner + [NO_REGION], np.int32)[area].reshape(height, width)
+    return regions, names, applied
+
+
+def load_label_map(image_path, img, seed_points, tolerance=FILL_TOLERANCE):
+    """label_regions con caché en memoria y en disco (<imagen>_labels.npz).
+
+    La clave es un hash de la imagen, las semillas y la tolerancia, así que
+    un archivo de caché desactualizado se recalcula solo.
+    """
+    digest = hashlib.sha1(img.tobytes())
+    # El orden de las semillas importa: decide qué región se queda cada zona
+    digest.update(repr((list(seed_points.items()), tolerance)).encode())
+    key = digest.hexdigest()
+    if key in _label_maps:
+        return _label_maps[key]
+
+    cache_path = os.path.splitext(image_path)[0] + "_labels.npz"
+    label_map = None
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as data:
+                # Las cachés antiguas guardaban las etiquetas en uint8
+                if str(data["key"]) == key and data["regions"].dtype == np.int32:
+                    names = [str(name) for name in data["names"]]
+                    applied = dict(zip(names, data["applied"].tolist()))
+                    label_map = (data["regions"], names, applied)
+        except (OSError, KeyError, ValueError):
+            label_map = None
+
+    if label_map is None:
+        label_map = label_regions(img, seed_points, tolerance)
+        regions, names, applied = label_map
+        try:
+            np.savez_compressed(
+                cache_path, key=key, regions=regions,
+                names=np.array(names), applied=np.array([applied[n] for n in names])
+            )
+        except OSError as e:
+            print(f"Aviso: no se pudo guardar la caché de regiones: {e}")
+
+    _label_maps[key] = label_map
+    return label_map
+
+
+def render_solution(img, label_map, solution):
+    """Pinta una coloración indexando una tabla de colores con las etiquetas.
+
+    Con menos de 255 regiones las etiquetas caben en 8 bits y basta una
+    pasada de cv2.LUT (NO_REGION, -1, pasa a 255 y queda sin pintar); si
+    no, se indexa la tabla con NumPy, que es varias veces más lento.
+    """
+    regions, names, _ = label_map
+    if len(names) < 255:
+        table = np.zeros((1, 256, 3), np.uint8)
+        painted = np.zeros(256, np.uint8)
+        for index, region in enumerate(names):
+            if region in solution:
+                table[0, index] = COLOR_BGR.get(solution[region], (0, 0, 0))
+                painted[index] = 255
+
+        labels = regions.astype(np.uint8)
+        colored_img = img.copy()
+        cv2.copyTo(cv2.LUT(cv2.merge([labels] * 3), table), cv2.LUT(labels, painted), colored_img)
+        return colored_img
+
+    # Una entrada por región más la última para NO_REGION (índice -1)
+    table = np.zeros((len(names) + 1, 3), np.uint8)
+    painted = np.zeros(len(names) + 1, bool)
+    for index, region in enumerate(names):
+        if region in solution:
+            table[index] = COLOR_BGR.get(solution[region], (0, 0, 0))
+            painted[index] = True
+
+    colored_img = img.copy()
+    mask = np.take(painted, regions)
+    np.copyto(colored_img, np.take(table, regions, axis=0), where=mask[..., None])
+    return colored_img
+
 
 def visualize_solution(solution, image_path, seed_points=None):
-    """Colorea el mapa real de Baja California usando floodFill"""
+    """Colorea el mapa real de Baja California con un mapa de etiquetas"""
     try:
         if not os.path.exists(image_path):
             print(f"Error: No se encontró la imagen en '{image_path}'")
@@ -250,88 +252,18 @@ def visualize_solution(solution, image_path, seed_points=None):
         height, width = img.shape[:2]
         print(f"Imagen cargada: {width}x{height} píxeles")
 
-        colored_img = img.copy()
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Colores BGR (OpenCV usa BGR, no RGB)
-        color_map = {
-            "Verde": (0, 255, 0),      # Verde brillante
-            "Azul": (255, 0, 0),       # Azul brillante
-            "Amarillo": (0, 255, 255)  # Amarillo brillante
-        }
-
-        # Puntos semilla para cada municipio (ajústalo según tu imagen)
         if seed_points is None:
-            seed_points = {
-                "Tijuana": [
-                    (int(width * 0.08), int(height * 0.05)),
-                    (int(width * 0.09), int(height * 0.08)),
-                    (int(width * 0.10), int(height * 0.07)),
-                ],
-                "Rosarito": [
-                    (int(width * 0.08), int(height * 0.12)),
-                    (int(width * 0.09), int(height * 0.15)),
-                    (int(width * 0.07), int(height * 0.14)),
-                ],
-                "Tecate": [
-                    (int(width * 0.20), int(height * 0.08)),
-                    (int(width * 0.22), int(height * 0.10)),
-                    (int(width * 0.18), int(height * 0.09)),
-                ],
-                "Ensenada": [
-                    (int(width * 0.12), int(height * 0.25)),
-                    (int(width * 0.15), int(height * 0.30)),
-                    (int(width * 0.10), int(height * 0.28)),
-                    (int(width * 0.13), int(height * 0.35)),
-                ],
-                "Mexicali": [
-                    (int(width * 0.40), int(height * 0.08)),
-                    (int(width * 0.45), int(height * 0.10)),
-                    (int(width * 0.42), int(height * 0.12)),
-                    (int(width * 0.38), int(height * 0.11)),
-                ],
-                "San Felipe": [
-                    (int(width * 0.45), int(height * 0.35)),
-                    (int(width * 0.47), int(height * 0.38)),
-                    (int(width * 0.43), int(height * 0.33)),
-                ],
-                "San Quintin": [
-                    (int(width * 0.18), int(height * 0.60)),
-                    (int(width * 0.20), int(height * 0.65)),
-                    (int(width * 0.16), int(height * 0.62)),
-                ]
-            }
+            seed_points = default_seed_points(width, height)
+
+        label_map = load_label_map(image_path, img, seed_points)
+        applied = label_map[2]
 
         print("\nColoreando regiones:")
         for region, color_name in solution.items():
             if region in seed_points:
-                color = color_map.get(color_name, (0, 0, 0))
-                points_colored = 0
-
-                print(f"  {region} -> {color_name}", end=" ")
-
-                for seed in seed_points[region]:
-                    x, y = seed
-                    if 0 <= x < width and 0 <= y < height:
-                        # Verificar si el píxel es blanco (parte del mapa)
-                        pixel_value = gray[y, x]
-                        if pixel_value > 200:  # Píxel blanco
-                            mask = np.zeros((height + 2, width + 2), np.uint8)
-                            try:
-                                cv2.floodFill(
-                                    colored_img,
-                                    mask,
-                                    (x, y),
-                                    color,
-                                    loDiff=(30, 30, 30),
-                                    upDiff=(30, 30, 30),
-                                    flags=cv2.FLOODFILL_FIXED_RANGE
-                                )
-                                points_colored += 1
-                            except Exception as e:
-                                pass
-
-                print(f"({points_colored} puntos aplicados)")
+                print(f"  {region} -> {color_name} ({applied[region]} puntos aplicados)")
+
+        colored_img = render_solution(img, label_map, solution)
 
         output_path = os.path.splitext(image_path)[0] + "_coloreado.png"
         cv2.imwrite(output_path, colored_img)
@@ -342,70 +274,91 @@ def visualize_solution(solution, image_path, seed_points=None):
         import traceback
         traceback.print_exc()
 
+
 def solve_csp(algorithm="backtrack", var_heuristic="none", val_heuristic="none",
-              use_arc3=False, use_mac=True, image_path=None):
-    global stats
-    stats = {'steps': 0, 'backtracks': 0, 'assignments': 0}
+              use_arc3=False, use_mac=True, image_path=None, csp=None, metrics=None,
+              count=False):
+    """Resuelve e informa por pantalla; `metrics` (SolveMetrics) recoge los
+    tiempos por fase y, si tiene trace, los eventos de la búsqueda. Con
+    `count` también se informa del número de coloraciones válidas, cuyo
+    cálculo puede costar mucho más que la búsqueda en mapas grandes"""
+    csp = csp or BC_CSP
+    stats = csp.reset_stats()
+    metrics = metrics if metrics is not None else SolveMetrics()
 
     print("="*60)
     print("RESOLVIENDO CSP - COLORACIÓN DE MAPA DE BAJA CALIFORNIA")
     print("="*60)
 
-    domains = initialize_domains()
-
-    if use_arc3:
-        print("\n1. Aplicando AC-3 (Arc Consistency)...")
-        start_arc3 = time.time()
-        if not arc3(domains):
-            print("   ✗ AC-3 detectó que no hay solución")
-            return None
-        end_arc3 = time.time()
-        print(f"   ✓ AC-3 completado en {end_arc3 - start_arc3:.4f} segundos")
-        print("\n   Dominios después de AC-3:")
-        for var in VARIABLES:
-            print(f"     {var}: {domains[var]}")
-
-    print(f"\n2. Configuración del algoritmo:")
-    print(f"   - Algoritmo: {algorithm}")
-    print(f"   - Heurística de variables: {var_heuristic}")
-    print(f"   - Heurística de valores: {val_heuristic}")
-    print(f"   - AC-3 inicial: {use_arc3}")
-    print(f"   - MAC (Maintaining Arc Consistency): {use_mac}")
-
-    print("\n3. Iniciando búsqueda backtracking...")
-    start_time = time.time()
-
-    solution = backtrack(dict(), var_heuristic, val_heuristic, domains, use_mac)
-
-    end_time = time.time()
-
+    with csp.instrument(metrics):
+        domains = csp.initialize_domains()
+
+        if use_arc3:
+            print("\n1. Aplicando AC-3 (Arc Consistency)...")
+            with metrics.phase("arc3"):
+                arc_consistent = csp.arc3(domains)
+            if not arc_consistent:
+                print("   ✗ AC-3 detectó que no hay solución")
+                return None
+            print(f"   ✓ AC-3 completado en {metrics.timings['arc3']:.4f} segundos")
+            print("\n   Dominios después de AC-3:")
+            for var in csp.variables:
+                print(f"     {var}: {csp.domain_values(domains[var])}")
+
+        print(f"\n2. Configuración del algoritmo:")
+        print(f"   - Algoritmo: {algorithm}")
+        print(f"   - Heurística de variables: {var_heuristic}")
+        print(f"   - Heurística de valores: {val_heuristic}")
+        print(f"   - AC-3 inicial: {use_arc3}")
+        print(f"   - MAC (Maintaining Arc Consistency): {use_mac}")
+
+        with metrics.phase("search"):
+            if algorithm == "min_conflicts":
+                # Búsqueda local: no usa heurísticas de orden ni MAC
+                print("\n3. Iniciando búsqueda de mínimos conflictos...")
+                solution = csp.min_conflicts()
+            else:
+                print("\n3. Iniciando búsqueda backtracking...")
+                with recursion_limit(len(csp.variables)):
+                    solution = csp.backtrack(dict(), var_heuristic, val_heuristic, domains, use_mac)
+
+    timings = metrics.timings
     print("\n" + "="*60)
     if solution:
         print("✓ SOLUCIÓN ENCONTRADA!")
         print("="*60)
         print("\nAsignación de colores:")
-        for city in VARIABLES:
+        for city in csp.variables:
             print(f"  {city:15} -> {solution[city]}")
 
         print(f"\nEstadísticas de ejecución:")
         print(f"  Pasos totales:        {stats['steps']}")
         print(f"  Retrocesos:           {stats['backtracks']}")
         print(f"  Asignaciones:         {stats['assignments']}")
-        print(f"  Tiempo de búsqueda:   {end_time - start_time:.4f} segundos")
+        print(f"  Tiempo de búsqueda:   {timings['search']:.4f} segundos")
+        print(f"    - propagación:      {timings.get('propagation', 0.0):.4f} segundos")
+        print(f"    - ordenación:       {timings.get('ordering', 0.0):.4f} segundos")
+        print(f"  Revisiones de arcos:  {metrics.revisions}")
+        print(f"  Podas por nivel:      {metrics.pruned_by_depth}")
 
         # Verificar que la solución es consistente
-        if consistent(solution):
+        if csp.consistent(solution):
             print("\n  ✓ La solución es consistente (ningún vecino tiene el mismo color)")
+        if count:
+            print(f"  Coloraciones válidas posibles: {csp.count_solutions()}")
 
         if image_path:
             print("\n4. Generando imagen coloreada...")
-            visualize_solution(solution, image_path)
+            with metrics.phase("render"):
+                visualize_solution(solution, image_path)
+            print(f"   Tiempo de renderizado: {timings['render']:.4f} segundos")
     else:
         print("✗ NO SE ENCONTRÓ SOLUCIÓN")
         print("="*60)
 
     return solution
 
+
 if __name__ == "__main__":
     # Obtener la ruta del directorio donde está este script
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -1,12 +1,18 @@
-from pgmpy.inference import VariableElimination
 from model import model
+from query_cache import QueryCache
+
+# La red se compila una vez y las consultas repetidas salen de la caché
+motor = QueryCache(model)
 
 def calcular_probabilidades():
     """
     Calcula las probabilidades solicitadas en el ejercicio
     """
-    # Crear objeto de inferencia
-    inferencia = VariableElimination(model)
+    # Las dos preguntas se resuelven en un solo lote
+    resultado1, resultado2 = motor.query_batch([
+        (['FS'], {'CE': 1}),            # CE="Si" (1=Si, 0=No)
+        (['FS'], {'CE': 1, 'ACT': 0}),  # CE="Si", ACT="No"
+    ])
 
     print(f'\n{"="*70}')
     print(f'SOLUCIÓN DEL EJERCICIO - REDES BAYESIANAS')
@@ -18,12 +24,7 @@ def calcular_probabilidades():
     print("Calcular la probabilidad de que el servidor falle si")
     print("se sabe que hubo un corte de energía.\n")
 
-    resultado1 = inferencia.query(
-        variables=['FS'],
-        evidence={'CE': 1}  # CE="Si" (1=Si, 0=No)
-    )
-
-    prob1 = resultado1.values[1]  # Probabilidad de FS="Si"
+    prob1 = resultado1[1]  # Probabilidad de FS="Si"
 
     print(f'P(FS="Si" | CE="Si") = {prob1:.6f}')
     print(f'\n Respuesta: Hay un {prob1*100:.2f}% de probabilidad')
@@ -39,12 +40,7 @@ def calcular_probabilidades():
     print("- Hubo un corte de energía")
     print("- NO hubo alta carga de trabajo\n")
 
-    resultado2 = inferencia.query(
-        variables=['FS'],
-        evidence={'CE': 1, 'ACT': 0}  # CE="Si", ACT="No"
-    )
-
-    prob2 = resultado2.values[1]  # Probabilidad de FS="Si"
+    prob2 = resultado2[1]  # Probabilidad de FS="Si"
 
     print(f' P(FS="Si" | CE="Si", ACT="No") = {prob2:.6f}')
     print(f'\n Respuesta: Hay un {prob2*100:.2f}% de probabilidad')
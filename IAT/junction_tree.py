@@ -0,0 +1,248 @@
+"""
+Árbol de uniones (junction tree) compilado para la red bayesiana
+
+La red se compila una sola vez: se moraliza, se triangula, se agrupan las
+variables en cliques conectados en árbol y se precalculan los potenciales
+iniciales y el orden de los mensajes. Después cada consulta solo absorbe
+la evidencia, propaga en dos pasadas (hojas -> raíz -> hojas) y
+marginaliza; una misma pasada da la posterior de todas las variables.
+"""
+
+from itertools import product
+
+import numpy as np
+
+
+class JunctionTree:
+
+    def __init__(self, model):
+        self.model = model
+        cpds = {cpd.variable: cpd for cpd in model.get_cpds()}
+        # Orden global fijo: los ejes de cada potencial siguen este orden
+        self.variables = list(model.nodes())
+        self.position = {var: i for i, var in enumerate(self.variables)}
+        self.cardinality = {var: cpds[var].variable_card for var in self.variables}
+        self.state_names = {var: list(cpds[var].state_names[var]) for var in self.variables}
+
+        self.cliques = self._build_cliques(cpds)
+        self.edges = self._build_tree()
+        self.potentials = self._build_potentials(cpds)
+
+        # Clique más pequeño que contiene a cada variable
+        self.home = {}
+        for i, clique in enumerate(self.cliques):
+            for var in clique:
+                if var not in self.home or len(clique) < len(self.cliques[self.home[var]]):
+                    self.home[var] = i
+
+        self.schedule = self._build_schedule()
+
+    # ------------------------------------------------------------------
+    # Compilación
+    # ------------------------------------------------------------------
+
+    def _build_cliques(self, cpds):
+        """Cliques maximales de la triangulación del grafo moral (mínimo relleno)"""
+        graph = {var: set() for var in self.variables}
+        for var, cpd in cpds.items():
+            family = [var] + list(cpd.variables[1:])
+            for a in family:
+                for b in family:
+                    if a != b:
+                        graph[a].add(b)
+
+        cliques = []
+        remaining = set(self.variables)
+
+        def fill_in(var):
+            # Aristas que habría que añadir al eliminar var
+            neighbors = list(graph[var] & remaining)
+            return sum(1 for i, a in enumerate(neighbors)
+                       for b in neighbors[i + 1:] if b not in graph[a])
+
+        while remaining:
+            var = min(remaining, key=lambda v: (fill_in(v), self.position[v]))
+            neighbors = graph[var] & remaining
+            for a in neighbors:
+                graph[a] |= neighbors - {a}
+            clique = neighbors | {var}
+            if not any(clique <= other for other in cliques):
+                cliques = [other for other in cliques if not other <= clique]
+                cliques.append(clique)
+            remaining.remove(var)
+
+        return [sorted(clique, key=self.position.get) for clique in cliques]
+
+    def _build_tree(self):
+        """Árbol de expansión máximo según el tamaño de los separadores"""
+        pairs = sorted(
+            ((len(set(a) & set(b)), i, j)
+             for i, a in enumerate(self.cliques)
+             for j, b in enumerate(self.cliques) if i < j),
+            reverse=True
+        )
+        component = list(range(len(self.cliques)))
+
+        def find(i):
+            while component[i] != i:
+                component[i] = component[component[i]]
+                i = component[i]
+            return i
+
+        edges = []
+        for _, i, j in pairs:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                component[root_i] = root_j
+                edges.append((i, j))
+        return edges
+
+    def _build_potentials(self, cpds):
+        """Producto de las CPDs asignadas a cada clique"""
+        potentials = [
+            np.ones([self.cardinality[var] for var in clique])
+            for clique in self.cliques
+        ]
+        for var, cpd in cpds.items():
+            family = list(cpd.variables)
+            i = min(
+                (i for i, clique in enumerate(self.cliques) if set(family) <= set(clique)),
+                key=lambda i: len(self.cliques[i])
+            )
+            potentials[i] = potentials[i] * self._expand(cpd.values, family, self.cliques[i])
+        return potentials
+
+    def _expand(self, values, variables, clique):
+        """Reordena los ejes de values al orden de clique y añade ejes de tamaño 1"""
+        ordered = sorted(variables, key=self.position.get)
+        values = np.transpose(values, [variables.index(var) for var in ordered])
+        shape = [self.cardinality[var] if var in variables else 1 for var in clique]
+        return values.reshape(shape)
+
+    def _build_schedule(self):
+        """Mensajes (origen, destino, ejes a sumar, forma en destino) en orden
+        de recogida hacia el clique 0 y luego de distribución"""
+        adjacent = {i: [] for i in range(len(self.cliques))}
+        for i, j in self.edges:
+            adjacent[i].append(j)
+            adjacent[j].append(i)
+
+        # Recorrido en profundidad desde la raíz
+        parent = {0: None}
+        visit = [0]
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            for j in adjacent[i]:
+                if j not in parent:
+                    parent[j] = i
+                    visit.append(j)
+                    stack.append(j)
+
+        collect = [(i, parent[i]) for i in reversed(visit) if parent[i] is not None]
+        distribute = [(j, i) for i, j in reversed(collect)]
+
+        schedule = []
+        for source, target in collect + distribute:
+            separator = set(self.cliques[source]) & set(self.cliques[target])
+            axes = tuple(k for k, var in enumerate(self.cliques[source]) if var not in separator)
+            shape = [self.cardinality[var] if var in separator else 1
+                     for var in self.cliques[target]]
+            schedule.append((source, target, axes, shape))
+        self.neighbors = adjacent
+        return schedule
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def state_index(self, var, state):
+        """Índice del estado; acepta el nombre del estado o su número"""
+        names = self.state_names[var]
+        if state in names:
+            return names.index(state)
+        if isinstance(state, (int, np.integer)) and 0 <= state < self.cardinality[var]:
+            return int(state)
+        raise ValueError(f"Estado desconocido para {var}: {state!r}")
+
+    def calibrate(self, evidence=None):
+        """Absorbe la evidencia y propaga; devuelve las creencias de cada clique
+        (proporcionales a P(clique, evidencia))"""
+        potentials = list(self.potentials)
+        for var, state in (evidence or {}).items():
+            i = self.home[var]
+            mask = np.zeros(self.cardinality[var])
+            mask[self.state_index(var, state)] = 1.0
+            shape = [self.cardinality[v] if v == var else 1 for v in self.cliques[i]]
+            potentials[i] = potentials[i] * mask.reshape(shape)
+
+        # Shafer-Shenoy: el mensaje i -> j usa todos los mensajes que llegan a i menos el de j
+        messages = {}
+        for source, target, axes, shape in self.schedule:
+            factor = potentials[source]
+            for k in self.neighbors[source]:
+                if k != target and (k, source) in messages:
+                    factor = factor * messages[(k, source)]
+            messages[(source, target)] = factor.sum(axis=axes).reshape(shape)
+
+        beliefs = []
+        for i, potential in enumerate(potentials):
+            for k in self.neighbors[i]:
+                potential = potential * messages[(k, i)]
+            beliefs.append(potential)
+        return beliefs
+
+    def marginal(self, beliefs, var):
+        i = self.home[var]
+        axes = tuple(k for k, v in enumerate(self.cliques[i]) if v != var)
+        values = beliefs[i].sum(axis=axes)
+        total = values.sum()
+        if total == 0:
+            raise ValueError("La evidencia tiene probabilidad 0")
+        return values / total
+
+    def posteriors(self, evidence=None):
+        """P(var | evidencia) para todas las variables sin evidencia, en una pasada"""
+        evidence = evidence or {}
+        beliefs = self.calibrate(evidence)
+        return {var: self.marginal(beliefs, var)
+                for var in self.variables if var not in evidence}
+
+    def evidence_probability(self, evidence=None):
+        """P(evidencia)"""
+        return float(self.calibrate(evidence)[0].sum())
+
+    def query(self, variables, evidence=None, beliefs=None):
+        """Distribución conjunta de variables dada la evidencia.
+
+        Devuelve un arreglo con un eje por variable, en el orden dado. Si
+        todas caben en un clique basta una propagación; si no, se aplica la
+        regla de la cadena fijando como evidencia las primeras variables.
+        `beliefs` reutiliza una calibración ya hecha con esa evidencia.
+        """
+        evidence = dict(evidence or {})
+        variables = list(variables)
+        if beliefs is None:
+            beliefs = self.calibrate(evidence)
+        if len(variables) == 1:
+            return self.marginal(beliefs, variables[0])
+
+        for i, clique in enumerate(self.cliques):
+            if set(variables) <= set(clique):
+                axes = tuple(k for k, v in enumerate(clique) if v not in variables)
+                values = beliefs[i].sum(axis=axes)
+                values = np.transpose(values, [
+                    sorted(variables, key=self.position.get).index(var) for var in variables
+                ])
+                return values / values.sum()
+
+        head, last = variables[:-1], variables[-1]
+        joint = np.zeros([self.cardinality[var] for var in variables])
+        total = beliefs[0].sum()
+        for states in product(*(range(self.cardinality[var]) for var in head)):
+            fixed = {**evidence, **dict(zip(head, states))}
+            beliefs = self.calibrate(fixed)
+            weight = beliefs[0].sum()
+            if weight > 0:
+                joint[states] = weight / total * self.marginal(beliefs, last)
+        return joint
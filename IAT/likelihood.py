@@ -1,28 +1,93 @@
 from itertools import product
+from math import prod
+
+import numpy as np
+from networkx import topological_sort
+
 from model import model
 
-names = [s.name for s in model.states]
-dom = {"CE":["Si","No"], "ACT":["Si","No"], "MF":["Si","No"], "SC":["Si","No"], "FS":["Si","No"]}
+# En las CPDs el estado 0 es "No" y el 1 es "Si"
+dom = {"CE": ["No", "Si"], "ACT": ["No", "Si"], "MF": ["No", "Si"], "SC": ["No", "Si"], "FS": ["No", "Si"]}
+
+
+class JointTensor:
+    """Enumeración exacta con la distribución conjunta como tensor.
+
+    Si la conjunta cabe en `max_entries` celdas se calcula una sola vez
+    como producto de las CPDs (np.einsum) y cada consulta es indexar y
+    sumar. Si no cabe, cada consulta recorre por bloques los estados de
+    las primeras variables libres y contrae el resto, de modo que nunca
+    hay en memoria más de unas max_entries celdas.
+    """
+
+    def __init__(self, model, max_entries=2 ** 24):
+        cpds = {cpd.variable: cpd for cpd in model.get_cpds()}
+        self.variables = list(topological_sort(model))
+        self.axis = {var: i for i, var in enumerate(self.variables)}
+        self.cardinality = {var: cpds[var].variable_card for var in self.variables}
+        # (valores, variables de cada eje) por CPD
+        self.factors = [(cpd.values, list(cpd.variables)) for cpd in cpds.values()]
+        self.max_entries = max_entries
+
+        self.joint = None
+        if prod(self.cardinality.values()) <= max_entries:
+            self.joint = self._contract({}, self.variables)
+
+    def _contract(self, fixed, output):
+        """Producto de las CPDs con las variables de `fixed` fijadas,
+        sumando las que no están en output"""
+        operands = []
+        for values, variables in self.factors:
+            index = tuple(fixed.get(var, slice(None)) for var in variables)
+            kept = [self.axis[var] for var in variables if var not in fixed]
+            operands += [values[index], kept]
+        return np.einsum(*operands, [self.axis[var] for var in output], optimize=True)
+
+    def marginal(self, targets, fixed=None):
+        """P(targets, fixed) con un eje por variable de targets, en su orden"""
+        fixed = fixed or {}
+        targets = list(targets)
+        if self.joint is not None:
+            table = self.joint[tuple(fixed.get(var, slice(None)) for var in self.variables)]
+            free = [var for var in self.variables if var not in fixed]
+            table = table.sum(axis=tuple(i for i, var in enumerate(free) if var not in targets))
+            remaining = [var for var in free if var in targets]
+            return np.transpose(table, [remaining.index(var) for var in targets])
+
+        # Por bloques: se fijan variables libres hasta que el resto quepa
+        free = [var for var in self.variables if var not in fixed and var not in targets]
+        size = prod(self.cardinality[var] for var in free + targets)
+        split = []
+        while size > self.max_entries and free:
+            var = free.pop(0)
+            split.append(var)
+            size //= self.cardinality[var]
+
+        table = 0.0
+        for states in product(*(range(self.cardinality[var]) for var in split)):
+            table = table + self._contract({**fixed, **dict(zip(split, states))}, targets)
+        return table
+
+
+engine = JointTensor(model)
+
 
-def row(assign):
-    return [assign[n] for n in names]
+def _indices(assign):
+    return {var: dom[var].index(val) for var, val in assign.items()}
 
 def evidence_probability(evid):
-    p = 0.0
-    grids = [dom[n] for n in names]
-    for vals in product(*grids):
-        a = {n: v for n, v in zip(names, vals)}
-        if all(a[k] == v for k, v in evid.items()):
-            p += model.probability([row(a)])
-    return p
+    return float(engine.marginal([], _indices(evid)))
 
 def query_probability(var, val, evid=None):
     evid = evid or {}
-    pe = evidence_probability(evid)
+    if var in evid:
+        return float(evid[var] == val)
+    # Una sola pasada: P(var, evid) para todos los valores de var
+    table = engine.marginal([var], _indices(evid))
+    pe = table.sum()
     if pe == 0.0:
         return 0.0
-    pj = evidence_probability({**evid, var: val})
-    return pj / pe
+    return float(table[dom[var].index(val)] / pe)
 
 if __name__ == "__main__":
     p = query_probability("FS", "Si", {"CE": "Si"})
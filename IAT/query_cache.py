@@ -0,0 +1,91 @@
+"""
+Capa de consultas con caché sobre la red bayesiana
+
+Las consultas se identifican por (variables, evidencia) con la evidencia
+normalizada (ordenada y con los estados como índices), así que
+{'CE': 1, 'ACT': 0} y {'ACT': 0, 'CE': 1} son la misma consulta. Los
+resultados se guardan en una caché LRU de tamaño fijo que se vacía sola
+cuando se reemplaza alguna CPD del modelo.
+"""
+
+from collections import OrderedDict
+
+from junction_tree import JunctionTree
+
+
+class QueryCache:
+
+    def __init__(self, model, maxsize=256):
+        self.model = model
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.cpds = None
+        self.engine = None
+        self.refresh()
+
+    def refresh(self):
+        """Recompila la red y vacía la caché si cambió alguna CPD.
+
+        Se comparan los objetos CPD, no sus valores: modificar en sitio los
+        valores de una CPD no se detecta (llama a invalidate()).
+        """
+        cpds = self.model.get_cpds()
+        if (self.cpds is not None and len(cpds) == len(self.cpds)
+                and all(a is b for a, b in zip(cpds, self.cpds))):
+            return
+        self.invalidate()
+
+    def invalidate(self):
+        self.cpds = list(self.model.get_cpds())
+        self.engine = JunctionTree(self.model)
+        self.cache.clear()
+
+    def key(self, variables, evidence=None):
+        """Clave canónica de una consulta"""
+        evidence = tuple(sorted(
+            (var, self.engine.state_index(var, state))
+            for var, state in (evidence or {}).items()
+        ))
+        return tuple(variables), evidence
+
+    def query(self, variables, evidence=None):
+        return self.query_batch([(variables, evidence)])[0]
+
+    def query_batch(self, queries):
+        """Resuelve una lista de (variables, evidencia) y devuelve los
+        resultados en el mismo orden.
+
+        Las consultas repetidas se calculan una sola vez y las que comparten
+        evidencia salen de la misma propagación. Los arreglos devueltos son
+        de solo lectura porque se comparten con la caché.
+        """
+        self.refresh()
+        keys = [self.key(variables, evidence) for variables, evidence in queries]
+
+        results = {}
+        pending = {}
+        for key in keys:
+            if key in results or key in pending.get(key[1], ()):
+                continue
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                results[key] = self.cache[key]
+            else:
+                pending.setdefault(key[1], set()).add(key)
+
+        for evidence, group in pending.items():
+            evidence = dict(evidence)
+            beliefs = self.engine.calibrate(evidence)
+            for key in group:
+                values = self.engine.query(key[0], evidence, beliefs)
+                values.setflags(write=False)
+                results[key] = values
+                self.cache[key] = values
+                self.misses += 1
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+        self.hits += len(keys) - sum(len(group) for group in pending.values())
+        return [results[key] for key in keys]
@@ -1,14 +1,178 @@
+from collections import namedtuple
+
+import numpy as np
+from networkx import topological_sort
+
 from model import model
 
-def p_fs_given_ce_si_sample(N=300_000):
-    ok = si = 0
-    for _ in range(N):
-        s = model.sample()
-        if s["CE"] == "Si":
-            ok += 1
-            si += (s["FS"] == "Si")
-    return (si / ok) if ok else float("nan")
+# Los estados son índices: 1 = "Si", 0 = "No"
+SI = 1
+
+# Estimación ponderada: probabilidad, tamaño efectivo de muestra e IC
+Estimate = namedtuple("Estimate", ["p", "ess", "low", "high"])
+
+
+def _needed(model, variables):
+    """Variables pedidas y sus ancestros (el resto no influye)"""
+    if variables is None:
+        return None
+    needed = set(variables)
+    for var in variables:
+        needed |= model.get_ancestral_graph([var]).nodes()
+    return needed
+
+
+def _ancestral(model, N, rng, needed=None, evidence=None, proposal=None):
+    """Muestreo ancestral vectorizado con evidencia fijada.
+
+    Las columnas de cada CPD se eligen a la vez con los estados ya
+    muestreados de los padres y se comparan N uniformes con sus
+    acumuladas. Las variables de `evidence` no se muestrean: valen su
+    estado y multiplican el peso por su probabilidad. Las demás se toman
+    de `proposal[var]` (misma forma que la CPD) si se da, corrigiendo el
+    peso por P/Q. Devuelve (muestras, pesos, columnas de cada variable).
+    """
+    evidence = evidence or {}
+    proposal = proposal or {}
+    samples = {}
+    columns = {}
+    weights = np.ones(N)
+    for var in topological_sort(model):
+        if needed is not None and var not in needed:
+            continue
+        cpd = model.get_cpds(var)
+        parents = cpd.variables[1:]
+        # Filas: estados de var; columnas: combinaciones de los padres
+        table = cpd.get_values()
+        if parents:
+            column = np.ravel_multi_index([samples[p] for p in parents], cpd.cardinality[1:])
+        else:
+            column = np.zeros(N, np.intp)
+        columns[var] = column
+
+        if var in evidence:
+            state = evidence[var]
+            samples[var] = np.full(N, state, np.int8)
+            weights *= table[state, column]
+            continue
+
+        q = proposal.get(var, table)
+        cumulative = np.cumsum(q, axis=0)[:-1]
+        states = (rng.random(N) >= cumulative[:, column]).sum(axis=0)
+        if q is not table:
+            weights *= table[states, column] / q[states, column]
+        samples[var] = states.astype(np.int8)
+    return samples, weights, columns
+
+
+def forward_sample(model, N, variables=None, seed=None):
+    """Muestreo ancestral vectorizado.
+
+    Genera N muestras por nodo en orden topológico; solo se muestrean las
+    variables pedidas y sus ancestros. Devuelve {variable: arreglo int8}.
+    """
+    rng = np.random.default_rng(seed)
+    samples, _, _ = _ancestral(model, N, rng, _needed(model, variables))
+    if variables is not None:
+        return {var: samples[var] for var in variables}
+    return samples
+
+
+def likelihood_weighting(model, N, evidence, variables=None, seed=None):
+    """Ponderación por verosimilitud: la evidencia se fija en lugar de
+    rechazar muestras y cada muestra pesa P(evidencia | padres).
+    Devuelve (muestras, pesos)."""
+    rng = np.random.default_rng(seed)
+    needed = _needed(model, None if variables is None else list(variables) + list(evidence))
+    samples, weights, _ = _ancestral(model, N, rng, needed, evidence)
+    return samples, weights
+
+
+def adaptive_importance_sampling(model, N, evidence, variables=None, stages=4,
+                                 rate=0.4, floor=0.01, seed=None):
+    """Muestreo por importancia con propuesta aprendida (estilo AIS-BN).
+
+    La propuesta empieza siendo la red misma y tiene una tabla por
+    variable sin evidencia. La mitad de las N muestras se reparte en
+    `stages` etapas; tras cada una, cada columna de la tabla se acerca en
+    `rate` a las frecuencias ponderadas observadas, con un mínimo `floor`
+    por estado para que los pesos no exploten. La otra mitad se muestrea
+    con la propuesta final; si N < 2 * stages no hay etapas y todas las
+    muestras salen de la red. Devuelve (muestras, pesos) de todas las etapas.
+    """
+    rng = np.random.default_rng(seed)
+    needed = _needed(model, None if variables is None else list(variables) + list(evidence))
+    proposal = {}
+    for var in topological_sort(model):
+        if var not in evidence and (needed is None or var in needed):
+            proposal[var] = model.get_cpds(var).get_values().copy()
+
+    batch = N // (2 * stages)
+    if batch == 0:
+        stages = 0
+    drawn = []
+    for _ in range(stages):
+        samples, weights, columns = _ancestral(model, batch, rng, needed, evidence, proposal)
+        drawn.append((samples, weights))
+        if not weights.any():
+            continue
+        for var, q in proposal.items():
+            card, width = q.shape
+            counts = np.bincount(
+                columns[var] * card + samples[var], weights=weights, minlength=card * width
+            ).reshape(width, card).T
+            totals = counts.sum(axis=0)
+            seen = totals > 0
+            q[:, seen] += rate * (counts[:, seen] / totals[seen] - q[:, seen])
+            np.maximum(q, floor, out=q)
+            q /= q.sum(axis=0)
+
+    samples, weights, _ = _ancestral(model, N - stages * batch, rng, needed, evidence, proposal)
+    drawn.append((samples, weights))
+    # Cada etapa tiene pesos válidos para su propia propuesta: se usan todas
+    samples = {var: np.concatenate([s[var] for s, _ in drawn]) for var in samples}
+    weights = np.concatenate([w for _, w in drawn])
+    if variables is not None:
+        samples = {var: samples[var] for var in variables}
+    return samples, weights
+
+
+def weighted_estimate(indicator, weights, z=1.96):
+    """Media ponderada de indicator con su tamaño efectivo de muestra
+    (sum w)^2 / sum w^2 y un intervalo de confianza normal aproximado"""
+    total = weights.sum()
+    if total == 0:
+        return Estimate(float("nan"), 0.0, float("nan"), float("nan"))
+    p = float((weights * indicator).sum() / total)
+    ess = float(total ** 2 / (weights ** 2).sum())
+    # Error estándar del estimador de razón (método delta)
+    se = float(np.sqrt((weights ** 2 * (indicator - p) ** 2).sum()) / total)
+    return Estimate(p, ess, max(0.0, p - z * se), min(1.0, p + z * se))
+
+
+def p_fs_given_ce_si_sample(N=300_000, seed=None):
+    """Muestreo por rechazo (referencia): se descartan las muestras con CE="No" """
+    s = forward_sample(model, N, variables=["CE", "FS"], seed=seed)
+    ok = s["CE"] == SI
+    return weighted_estimate(s["FS"] == SI, ok.astype(float))
+
+
+def p_fs_given_evidence(evidence, N=30_000, method="lw", seed=None):
+    """P(FS="Si" | evidencia) por ponderación ("lw") o importancia adaptativa ("ais")"""
+    if method == "ais":
+        samples, weights = adaptive_importance_sampling(model, N, evidence, ["FS"], seed=seed)
+    else:
+        samples, weights = likelihood_weighting(model, N, evidence, ["FS"], seed=seed)
+    return weighted_estimate(samples["FS"] == SI, weights)
 
 if __name__ == "__main__":
-    p = p_fs_given_ce_si_sample()
-    print(f'MUESTREO  P(FS="Si" | CE="Si") = {p:.6f}')
+    def show(name, e):
+        print(f'{name}  p = {e.p:.6f}  ESS = {e.ess:9.0f}  IC95% = [{e.low:.4f}, {e.high:.4f}]')
+
+    print('P(FS="Si" | CE="Si")')
+    show("RECHAZO    (N=300000)", p_fs_given_ce_si_sample())
+    show("PONDERADO  (N=30000) ", p_fs_given_evidence({"CE": SI}))
+
+    print('\nP(FS="Si" | MF="Si", SC="No")')
+    show("PONDERADO  (N=30000) ", p_fs_given_evidence({"MF": SI, "SC": 0}))
+    show("ADAPTATIVO (N=30000) ", p_fs_given_evidence({"MF": SI, "SC": 0}, method="ais"))